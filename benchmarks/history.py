@@ -0,0 +1,260 @@
+"""
+Benchmarks of the history: load time, peak memory, `append_to_history`, up-arrow,
+Ctrl-R and auto suggestion latency, for synthesized history files of each backend.
+R is not needed, the buffer runs with a stub session.
+
+    python benchmarks/history.py [--sizes 1000,20000,200000] [--backends file,mmap,sqlite]
+    python benchmarks/history.py --json results.json
+    python benchmarks/history.py --compare before.json after.json
+
+Times are in microseconds unless stated otherwise, memory is the peak of the python
+allocations in kilobytes, as traced by `tracemalloc`.
+"""
+import json
+import optparse
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompt_toolkit.document import Document  # noqa: E402
+from prompt_toolkit.search import SearchState, SearchDirection  # noqa: E402
+
+from radian.lineedit.auto_suggest import AutoSuggestFromHistory  # noqa: E402
+from radian.lineedit.buffer import ModalBuffer  # noqa: E402
+from radian.lineedit.history import ModalFileHistory, ModalMappedHistory  # noqa: E402
+from radian.lineedit.history_sqlite import ModalSQLiteHistory  # noqa: E402
+from radian.lineedit.prompt import ModeSpec  # noqa: E402
+
+
+class Session:
+    add_history = True
+    current_mode = "r"
+    specs = {
+        "r": ModeSpec("r"),
+        "browse": ModeSpec("browse", history_book="r"),
+        "shell": ModeSpec("shell"),
+        "python": ModeSpec("python")
+    }
+
+    @property
+    def current_mode_spec(self):
+        return self.specs[self.current_mode]
+
+
+MODES = [("r", 80), ("shell", 10), ("browse", 5), ("python", 5)]
+
+R_LINES = [
+    "library({pkg})",
+    "df{i} <- read.csv(\"data/file{i}.csv\")",
+    "summary(df{i})",
+    "plot(df{i}$x, df{i}$y, main = \"run {i}\")",
+    "fit{i} <- lm(y ~ x + z, data = df{i})",
+    "df{i} %>% filter(x > {i}) %>% group_by(z) %>% summarise(n = n())",
+    "install.packages(\"{pkg}\")",
+    "x <- rnorm({i})"
+]
+
+R_BLOCKS = [
+    "f{i} <- function(x, y = {i}) {{\n  z <- x + y\n  z * 2\n}}",
+    "for (i in seq_len({i})) {{\n  print(i)\n}}",
+    "ggplot(df{i}, aes(x, y)) +\n  geom_point() +\n  theme_minimal()"
+]
+
+SHELL_LINES = ["ls -la", "cd project{i}", "git status", "git log --oneline -n {i}", "make test"]
+PYTHON_LINES = ["import numpy as np", "x = np.arange({i})", "print(x.mean())"]
+PACKAGES = ["dplyr", "ggplot2", "data.table", "tidyr", "purrr", "stringr", "lme4"]
+
+
+def synthesize(rng, n):
+    """
+    Yield `(mode, timestamp, text)` entries, 15% of the R entries are multiline.
+    """
+    modes = [m for m, w in MODES for _ in range(w)]
+    timestamp = 1.7e9
+    for i in range(n):
+        mode = rng.choice(modes)
+        timestamp += rng.randint(1, 120)
+        if mode in ("r", "browse"):
+            template = rng.choice(R_BLOCKS if rng.random() < 0.15 else R_LINES)
+        elif mode == "shell":
+            template = rng.choice(SHELL_LINES)
+        else:
+            template = rng.choice(PYTHON_LINES)
+        yield (mode, timestamp, template.format(i=i % 997, pkg=rng.choice(PACKAGES)))
+
+
+def write_history_file(path, n, seed=0):
+    ModalFileHistory(path, 0).append_entries(synthesize(random.Random(seed), n))
+
+
+def open_history(backend, path, n):
+    if backend == "file":
+        return ModalFileHistory(path, n * 2)
+    elif backend == "mmap":
+        return ModalMappedHistory(path, n * 2)
+    return ModalSQLiteHistory(path + ".sqlite", n * 2, path)
+
+
+def elapsed_us(f, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        f()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def bench(backend, path, n, repeat):
+    """
+    Return the measurements of a backend with the history file `path` of `n` entries.
+    """
+    results = {}
+    start = time.perf_counter()
+    history = open_history(backend, path, n)
+    history.count()
+    results["load_ms"] = (time.perf_counter() - start) * 1e3
+
+    buf = ModalBuffer(history=history, session=Session(), search_no_duplicates=False)
+
+    def up():
+        buf.history_backward()
+    results["first_up_us"] = elapsed_us(up)
+    results["up_us"] = elapsed_us(up, repeat)
+
+    state = SearchState("summary(df", SearchDirection.BACKWARD)
+    buf.reset()
+
+    def search():
+        buf.apply_search(state, include_current_position=False)
+    results["first_search_us"] = elapsed_us(search)
+    results["search_us"] = elapsed_us(search, repeat)
+
+    buf.reset()
+    auto_suggest = AutoSuggestFromHistory()
+    prefixes = ["lib", "plot(df1", "fit", "df12 %>%", "summary(", "ggplot(df3"]
+    results["first_suggest_us"] = elapsed_us(
+        lambda: auto_suggest.get_suggestion(buf, Document(prefixes[0])))
+    results["suggest_us"] = elapsed_us(
+        lambda: [auto_suggest.get_suggestion(buf, Document(p)) for p in prefixes],
+        repeat) / len(prefixes)
+
+    texts = iter(["x{} <- {}".format(i, i) for i in range(repeat)])
+
+    def append():
+        buf.text = next(texts)
+        buf.append_to_history()
+    results["append_us"] = elapsed_us(append, repeat)
+    history.flush()
+    return results
+
+
+def bench_backend(backend, n, repeat):
+    workdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(workdir, "history")
+        write_history_file(path, n)
+        # the first load writes the sidecar index or the database
+        first_load_ms = elapsed_us(lambda: open_history(backend, path, n).count()) / 1e3
+
+        # allocations are traced in a separate run, as tracing slows them down
+        tracemalloc.start()
+        bench(backend, path, n, 1)
+        peak_kb = tracemalloc.get_traced_memory()[1] / 1024
+        tracemalloc.stop()
+
+        results = bench(backend, path, n, repeat)
+        results["first_load_ms"] = first_load_ms
+        results["peak_kb"] = peak_kb
+        return results
+    finally:
+        shutil.rmtree(workdir)
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, backends, repeat):
+    results = []
+    for n in sizes:
+        for backend in backends:
+            measurements = bench_backend(backend, n, repeat)
+            results.append({"backend": backend, "entries": n, "results": measurements})
+            print_row(backend, n, measurements)
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "benchmarks": results
+    }
+
+
+METRICS = [
+    "first_load_ms", "load_ms", "peak_kb", "append_us", "first_up_us", "up_us",
+    "first_search_us", "search_us", "first_suggest_us", "suggest_us"]
+
+
+def print_header():
+    print("{:>8} {:>8} ".format("backend", "entries") + " ".join(
+        "{:>16}".format(m) for m in METRICS))
+
+
+def print_row(backend, n, measurements):
+    print("{:>8} {:>8} ".format(backend, n) + " ".join(
+        "{:>16.1f}".format(measurements[m]) for m in METRICS))
+
+
+def compare(before, after):
+    """
+    Print the ratio of each measurement after to before, below 1 is an improvement.
+    """
+    old = {(b["backend"], b["entries"]): b["results"] for b in before["benchmarks"]}
+    print("{} -> {}".format(before.get("commit"), after.get("commit")))
+    print_header()
+    for b in after["benchmarks"]:
+        key = (b["backend"], b["entries"])
+        if key not in old:
+            continue
+        ratios = {
+            m: b["results"][m] / old[key][m] if old[key][m] else float("nan") for m in METRICS}
+        print_row(key[0], key[1], ratios)
+
+
+def main():
+    parser = optparse.OptionParser("usage: python benchmarks/history.py [options]")
+    parser.add_option("--sizes", default="1000,20000,200000",
+                      help="Comma separated numbers of history entries")
+    parser.add_option("--backends", default="file,mmap,sqlite",
+                      help="Comma separated history backends")
+    parser.add_option("--repeat", type="int", default=100,
+                      help="Number of repetitions of each latency measurement")
+    parser.add_option("--json", dest="json", help="Write the results to a JSON file")
+    parser.add_option("--compare", nargs=2, help="Compare two JSON result files")
+    options, _ = parser.parse_args()
+
+    if options.compare:
+        with open(options.compare[0]) as f, open(options.compare[1]) as g:
+            compare(json.load(f), json.load(g))
+        return
+
+    print_header()
+    results = run(
+        [int(n) for n in options.sizes.split(",")], options.backends.split(","), options.repeat)
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""
+Benchmarks of lexing R code: the throughput of `CustomSLexer`, of the string context
+behind `cursor_in_string` and of the highlighting of the R modes, and the latency of
+`cursor_in_string` and of the highlighting per keystroke, when a line is typed at the end
+and in the middle of the input. R is not needed.
+
+    python benchmarks/lexer.py [--sizes 100,1000,10000] [--inputs package,pipelines]
+    python benchmarks/lexer.py --json results.json
+    python benchmarks/lexer.py --compare before.json after.json
+
+The throughputs are in thousands of tokens of `CustomSLexer` per second, so that they are
+comparable. `lexer_ms` is the time to lex the whole input once, which is the latency per
+keystroke of highlighting without the incremental lexer. The latencies per keystroke are
+the mean and the worst of the keystrokes, in milliseconds, the highlighting gets the lines
+of a screen ending at the cursor.
+"""
+import json
+import optparse
+import os
+import platform
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompt_toolkit.document import Document  # noqa: E402
+
+from radian.document import RLexer, StringContext  # noqa: E402
+from radian.lexer import CustomSLexer  # noqa: E402
+from radian.lineedit.lexer import IncrementalLexer  # noqa: E402
+from tests.corpus import CORPUS  # noqa: E402
+
+
+PACKAGE = r'''#' Summarise the numeric columns of a data frame
+#'
+#' @param df A data frame.
+#' @param na.rm Whether the missing values are removed, see [mean()].
+#' @return A list of class `column_summary`, with the mean and the sd of each column.
+#' @export
+summarise_columns{i} <- function(df, ..., na.rm = TRUE) {
+  stopifnot(is.data.frame(df), is.logical(na.rm))
+  cols <- vapply(df, is.numeric, logical(1L))
+  if (!any(cols)) {
+    stop("`df` must have a numeric column, not '", class(df)[[1]], "'", call. = FALSE)
+  }
+  out <- lapply(df[cols], function(x) c(mean = mean(x, na.rm = na.rm), sd = sd(x)))
+  structure(out, class = c("column_summary", "list"))
+}
+
+#' @export
+print.column_summary{i} <- function(x, ...) {
+  cat(sprintf("%-10s %8.2f\n", names(x), unlist(x)), sep = "")
+  invisible(x)
+}
+
+.onLoad <- function(libname, pkgname) {
+  op <- options()
+  defaults <- list(pkg{i}.verbose = FALSE, pkg{i}.path = "~/.cache/pkg{i}")
+  toset <- !(names(defaults) %in% names(op))
+  if (any(toset)) options(defaults[toset])
+  invisible(NULL)
+}
+'''
+
+PIPELINES = r'''result{i} <- flights %>%
+  filter(!is.na(dep_delay), month == {i} %% 12 + 1, origin %in% c("JFK", 'LGA')) %>%
+  mutate(speed = distance / air_time * 60, label = paste0(carrier, "-", flight)) %>%
+  group_by(carrier, origin) %>%
+  summarise(n = n(), delay = mean(dep_delay), .groups = "drop") %>%
+  arrange(desc(delay)) |>
+  head(10L) |>
+  (\(d) d[d$n > 1e3, ])()
+'''
+
+RAW_STRINGS = r'''query{i} <- r"(SELECT * FROM "table" WHERE name = 'x' AND path LIKE '%\d+%')"
+pattern{i} <- r'[\d{2}-"\w+"]' # a pattern
+json{i} <- r"---{ {"a": [1, 2], "b": "}---" } }---"
+text{i} <- R"(
+  multiline, with ) and "quotes"
+)"
+'''
+
+INPUTS = ["package", "pipelines", "raw_strings", "nested_calls", "unterminated", "corpus"]
+
+KEYSTROKES = "y <- paste0(x, \"a'b\", r\"(c)\") # d\n"
+
+
+def nested_calls(i, depth=12):
+    call = "x{}".format(i)
+    for d in range(depth):
+        call = "f{}({}, arg{} = list(a = {}, b = \"{}\"))".format(d, call, d, i, d)
+    lines = ["nested{} <- list(".format(i)]
+    for d in range(depth):
+        lines.append("  " * (d + 1) + "list(level{} = c({}, '{}'),".format(d, d, d))
+    lines.append("  " * (depth + 1) + call + ")" * depth)
+    lines.append(")")
+    return "\n".join(lines) + "\n"
+
+
+def repeat_lines(make, n):
+    """
+    The first `n` lines of the blocks `make(i)`.
+    """
+    lines = []
+    i = 0
+    while len(lines) < n:
+        lines.extend(make(i).splitlines())
+        i += 1
+    return "\n".join(lines[:n])
+
+
+def make_input(name, n):
+    if name == "package":
+        return repeat_lines(lambda i: PACKAGE.replace("{i}", str(i)), n)
+    elif name == "pipelines":
+        return repeat_lines(lambda i: PIPELINES.replace("{i}", str(i)), n)
+    elif name == "raw_strings":
+        return repeat_lines(lambda i: RAW_STRINGS.replace("{i}", str(i)), n)
+    elif name == "nested_calls":
+        return repeat_lines(nested_calls, n)
+    elif name == "unterminated":
+        # a string and a raw string which are not closed, the rest of the input is a string
+        return repeat_lines(
+            lambda i: "msg <- \"not closed\n" if i == 0 else "x <- r'[\n" if i == 1 else
+            PACKAGE.replace("{i}", str(i)), n)
+    return repeat_lines(lambda i: CORPUS[i % len(CORPUS)], n)
+
+
+def elapsed_ms(f):
+    start = time.perf_counter()
+    f()
+    return (time.perf_counter() - start) * 1e3
+
+
+def typing(text, position):
+    """
+    Yield the documents of typing `KEYSTROKES` at `position` of `text`.
+    """
+    for i in range(1, len(KEYSTROKES) + 1):
+        yield Document(text[:position] + KEYSTROKES[:i] + text[position:], position + i)
+
+
+def keystroke_latencies(text, position, screen_lines, highlight_max_lines):
+    context = StringContext()
+    lexer = RLexer(highlight_max_lines)
+    document = Document(text, position)
+    context.cursor_in_string(document)
+    lexer.lex_document(document)
+    string_ms = []
+    highlight_ms = []
+    for document in typing(text, position):
+        string_ms.append(elapsed_ms(lambda: context.cursor_in_string(document)))
+
+        def highlight():
+            get_line = lexer.lex_document(document)
+            row = document.cursor_position_row
+            for i in range(max(row - screen_lines + 1, 0), row + 1):
+                get_line(i)
+        highlight_ms.append(elapsed_ms(highlight))
+    return string_ms, highlight_ms
+
+
+def bench(text, repeat, screen_lines, highlight_max_lines):
+    results = {}
+    lexer = CustomSLexer(stripnl=False, ensurenl=False)
+    tokens = sum(1 for _ in lexer.get_tokens_unprocessed(text))
+    results["tokens"] = tokens
+
+    def lex():
+        for _ in lexer.get_tokens_unprocessed(text):
+            pass
+    lexer_ms = min(elapsed_ms(lex) for _ in range(repeat))
+
+    document = Document(text)
+    string_ms = min(elapsed_ms(lambda: StringContext().update(document)) for _ in range(repeat))
+
+    def highlight():
+        get_line = IncrementalLexer(CustomSLexer).lex_document(document)
+        for i in range(len(document.lines)):
+            get_line(i)
+    highlight_ms = min(elapsed_ms(highlight) for _ in range(repeat))
+
+    results["lexer_ms"] = lexer_ms
+    results["lexer_ktok_s"] = tokens / lexer_ms
+    results["string_ktok_s"] = tokens / string_ms
+    results["highlight_ktok_s"] = tokens / highlight_ms
+
+    string_ms = []
+    highlight_ms = []
+    middle = document.translate_row_col_to_index(len(document.lines) // 2, 0)
+    for position in [len(text), middle]:
+        s, h = keystroke_latencies(text, position, screen_lines, highlight_max_lines)
+        string_ms.extend(s)
+        highlight_ms.extend(h)
+    results["key_string_ms"] = sum(string_ms) / len(string_ms)
+    results["key_string_max_ms"] = max(string_ms)
+    results["key_highlight_ms"] = sum(highlight_ms) / len(highlight_ms)
+    results["key_highlight_max_ms"] = max(highlight_ms)
+    return results
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes, inputs, repeat, screen_lines, highlight_max_lines):
+    results = []
+    for n in sizes:
+        for name in inputs:
+            measurements = bench(make_input(name, n), repeat, screen_lines, highlight_max_lines)
+            results.append({"input": name, "lines": n, "results": measurements})
+            print_row(name, n, measurements)
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "benchmarks": results
+    }
+
+
+METRICS = [
+    "tokens", "lexer_ktok_s", "string_ktok_s", "highlight_ktok_s", "lexer_ms",
+    "key_string_ms", "key_string_max_ms", "key_highlight_ms", "key_highlight_max_ms"]
+
+
+def print_header():
+    print("{:>12} {:>6} ".format("input", "lines") + " ".join(
+        "{:>20}".format(m) for m in METRICS))
+
+
+def print_row(name, n, measurements):
+    print("{:>12} {:>6} ".format(name, n) + " ".join(
+        "{:>20.2f}".format(measurements[m]) for m in METRICS))
+
+
+def compare(before, after):
+    """
+    Print the ratio of each measurement after to before. Below 1 is an improvement of the
+    latencies, above 1 is an improvement of the throughputs.
+    """
+    old = {(b["input"], b["lines"]): b["results"] for b in before["benchmarks"]}
+    print("{} -> {}".format(before.get("commit"), after.get("commit")))
+    print_header()
+    for b in after["benchmarks"]:
+        key = (b["input"], b["lines"])
+        if key not in old:
+            continue
+        ratios = {
+            m: b["results"][m] / old[key][m] if old[key][m] else float("nan") for m in METRICS}
+        print_row(key[0], key[1], ratios)
+
+
+def main():
+    parser = optparse.OptionParser("usage: python benchmarks/lexer.py [options]")
+    parser.add_option("--sizes", default="100,1000,10000",
+                      help="Comma separated numbers of lines of the inputs")
+    parser.add_option("--inputs", default=",".join(INPUTS),
+                      help="Comma separated inputs, of " + ", ".join(INPUTS))
+    parser.add_option("--repeat", type="int", default=3,
+                      help="Number of repetitions of each throughput measurement")
+    parser.add_option("--screen-lines", type="int", default=40,
+                      help="Number of lines displayed while typing")
+    parser.add_option("--highlight-max-lines", type="int", default=5000,
+                      help="As the option radian.highlight_max_lines")
+    parser.add_option("--json", dest="json", help="Write the results to a JSON file")
+    parser.add_option("--compare", nargs=2, help="Compare two JSON result files")
+    options, _ = parser.parse_args()
+
+    if options.compare:
+        with open(options.compare[0]) as f, open(options.compare[1]) as g:
+            compare(json.load(f), json.load(g))
+        return
+
+    print_header()
+    results = run(
+        [int(n) for n in options.sizes.split(",")], options.inputs.split(","),
+        options.repeat, options.screen_lines, options.highlight_max_lines)
+    if options.json:
+        with open(options.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Benchmarks of lexing raw strings: unterminated raw strings followed by growing text,
+runs of raw string openers and long terminated raw strings. The time per character
+should not grow with the size of the input.
+
+    python benchmarks/raw_strings.py [--sizes 1000,10000,100000]
+"""
+import optparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from radian.lexer import CustomSLexer  # noqa: E402
+
+
+INPUTS = [
+    ("unterminated", lambda n: "x <- r\"(" + "a" * n),
+    ("unterminated_lines", lambda n: "x <- r'[" + "abc;\n" * (n // 5)),
+    ("openers", lambda n: "r\"(" * (n // 3)),
+    ("dashes", lambda n: "r\"----{" + "}---\"" * (n // 5)),
+    ("terminated", lambda n: "x <- r\"-(" + "a)\" " * (n // 4) + ")-\""),
+]
+
+
+def elapsed_ms(text, repeat):
+    lexer = CustomSLexer(stripnl=False, ensurenl=False)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for _ in lexer.get_tokens_unprocessed(text):
+            pass
+    return (time.perf_counter() - start) / repeat * 1e3
+
+
+def main():
+    parser = optparse.OptionParser("usage: python benchmarks/raw_strings.py [options]")
+    parser.add_option("--sizes", default="1000,10000,100000",
+                      help="Comma separated numbers of characters")
+    parser.add_option("--repeat", type="int", default=3,
+                      help="Number of repetitions of each measurement")
+    options, _ = parser.parse_args()
+
+    print("{:>20} {:>10} {:>12} {:>12}".format("input", "chars", "ms", "ns/char"))
+    for name, make in INPUTS:
+        for n in (int(n) for n in options.sizes.split(",")):
+            text = make(n)
+            ms = elapsed_ms(text, options.repeat)
+            print("{:>20} {:>10} {:>12.2f} {:>12.1f}".format(
+                name, len(text), ms, ms * 1e6 / len(text)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,51 @@
+"""
+Cost of repeated reverse-i-search with `radian.history_search_no_duplicates`.
+
+Every Ctrl-R press adds the match to the visited set. The time per press
+should stay flat as the visited set grows.
+
+    python benchmarks/search_no_duplicates.py [entries]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from prompt_toolkit.search import SearchState, SearchDirection  # noqa: E402
+
+from radian.lineedit.buffer import ModalBuffer  # noqa: E402
+from radian.lineedit.history import ModalInMemoryHistory  # noqa: E402
+from radian.lineedit.prompt import ModeSpec  # noqa: E402
+
+
+class Session:
+    add_history = True
+    current_mode = "r"
+    specs = {"r": ModeSpec("r")}
+
+    @property
+    def current_mode_spec(self):
+        return self.specs[self.current_mode]
+
+
+def main(n=20000, buckets=10):
+    history = ModalInMemoryHistory()
+    for i in range(n):
+        history.append_string("foo({})".format(i), "r")
+
+    buf = ModalBuffer(history=history, session=Session(), search_no_duplicates=True)
+    state = SearchState("foo", SearchDirection.BACKWARD)
+
+    size = n // buckets
+    print("{:>12} {:>16}".format("visited", "us per search"))
+    for b in range(buckets):
+        start = time.perf_counter()
+        for _ in range(size):
+            buf.apply_search(state, include_current_position=False)
+        elapsed = time.perf_counter() - start
+        print("{:>12} {:>16.2f}".format(len(buf._search_history), elapsed / size * 1e6))
+
+
+if __name__ == "__main__":
+    main(*[int(x) for x in sys.argv[1:]])
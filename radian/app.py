@@ -278,6 +278,11 @@ class RadianApplication():
         if cleanup:
             rutils.register_cleanup(cleanup)
 
+        rutils.register_history_flush(self.session.history)
+        rutils.attach_radian_tools(
+            history_dedup=self.session.history.dedup_history,
+            history_entries=rutils.history_entries_tool(self.session.history))
+
         from . import reticulate
         reticulate.configure()
 
@@ -1,20 +1,276 @@
-from pygments.token import Token
-from radian.lexer import CustomSLexer
+import re
+import threading
+from bisect import bisect_left
 
-lexer = CustomSLexer()
+from prompt_toolkit.cache import SimpleCache
+from prompt_toolkit.lexers import Lexer, RegexSync
+from radian.lexer import CustomSLexer, StringSLexer, match_raw_string, RAW_STRING_OPENER, \
+    unterminated
+from radian.lineedit.lexer import IncrementalLexer
 
+# the lines which are likely outside of the strings: assignments and calls at the first
+# column, comments and closing braces
+R_SYNC = RegexSync(r"^(?:[A-Za-z.][\w.]*\s*(?:<<?-|=|\()|#|\})")
 
-def cursor_in_string(document):
-    tokens = list(lexer.get_tokens(document.text_before_cursor.rstrip()))
-    if not tokens:
-        return False
-    for t, s in reversed(tokens):
-        if t is Token.Text and s == "\n":
-            continue
-        elif t is Token.Error:
-            return True
-        elif t is Token.Literal.String:
-            return True
+
+class RLexer(Lexer):
+    """
+    Highlight R code. Only the comments and the strings of a document with more than
+    `max_lines` lines are highlighted, all documents are highlighted if it is 0.
+    """
+    def __init__(self, max_lines=0):
+        self.max_lines = max_lines
+        self.lexer = IncrementalLexer(CustomSLexer, syntax_sync=R_SYNC)
+        self.string_lexer = IncrementalLexer(StringSLexer, syntax_sync=R_SYNC)
+
+    def lex_document(self, document):
+        if self.max_lines and len(document.lines) > self.max_lines:
+            return self.string_lexer.lex_document(document)
+        return self.lexer.lex_document(document)
+
+
+def rules(state):
+    return "|".join("(?:{})".format(rule[0]) for rule in CustomSLexer.tokens[state])
+
+
+# the tokens of `CustomSLexer` in the root state, in the order the lexer tries them, with the
+# lexer's own rules, as the tokens without quotes decide where the next token starts
+ROOT_TOKEN = re.compile("|".join([
+    "(?P<keyword>{})".format(rules("keywords")),
+    "(?P<punctuation>{})".format(rules("punctuation")),
+    # the name of a call, without the spaces before the parenthesis
+    r"(?P<call>r{}(?=\s*\())".format(CustomSLexer.valid_name),
+    "(?P<comment>{})".format(rules("comments")),
+    r"(?P<space>\s+)",
+    "(?P<quote>['\"])",
+    "(?P<raw>[rR](?=['\"]))",
+    "(?P<builtin>{})".format(rules("builtin_symbols")),
+    "(?P<name>{})".format(CustomSLexer.valid_name),
+    "(?P<number>{})".format(rules("numbers")),
+    "(?P<operator>{})".format(rules("operators")),
+    r"(?P<other>.)"
+]), re.MULTILINE)
+
+STRING_BODY = {
+    "'": re.compile(r"(?:[^'\\]|\\.)*"),
+    '"': re.compile(r'(?:[^"\\]|\\.)*')
+}
+# "_" and the next character is the name of a call if a parenthesis follows, otherwise the
+# name is "_", so a parenthesis on the next lines changes the tokens
+UNDERSCORE_CALL = re.compile(r"_[^\w.\s(][\w.]*[^\S\n]*(\n|\Z)")
+BACKSLASH_OR_NEWLINE = re.compile(r"[\\\n]")
+BACKSLASHES = re.compile(r"\\+")
+
+STRING = "string"
+SPACE = "space"
+OTHER = "other"
+
+
+def scan_string(text, pos, quote):
+    """
+    Find where `CustomSLexer` leaves the state of the string opened by `quote` before `pos`.
+    The lexer tries to match the rest of the string at every position until it matches or
+    the line ends, these tries only differ after a backslash, so that the text is scanned
+    once. Return the position, whether a string ends there and whether it depends on the
+    text after it, which is the case unless the first try matches.
+    """
+    body = STRING_BODY[quote]
+    n = len(text)
+
+    def closes(i):
+        # the end of the string if the rest of the string is matched at `i`
+        e = body.match(text, i).end()
+        return e + 1 if e < n and text[e] == quote else None
+
+    end = closes(pos)
+    if end:
+        return end, True, False
+    while True:
+        m = BACKSLASH_OR_NEWLINE.search(text, pos)
+        if not m:
+            return n, False, True
+        j = m.start()
+        if text[j] == "\n":
+            return j + 1, False, True
+        # the tries in the backslashes alternate whether the character after them is escaped,
+        # the try at `j` failed
+        r = BACKSLASHES.match(text, j).end()
+        c = text[r] if r < n else None
+        if (r - j) % 2:
+            if r - j > 1 and c == quote:
+                return r + 1, True, True
+            if c == "\n":
+                # the newline was escaped in the try which failed
+                end = closes(r + 1)
+                if end:
+                    return end, True, True
+        if c is None:
+            return n, False, True
+        if c == quote:
+            return r + 1, True, True
+        if c == "\n":
+            return r + 1, False, True
+        pos = r + 1
+
+
+def scan(text, pos=0):
+    """
+    Yield the `(start, end, kind, lookahead)` tokens of `text` from `pos`, which is in the
+    root state of `CustomSLexer`. `kind` is `STRING` for a string or a raw string, `SPACE`
+    for whitespaces and `OTHER` otherwise. `lookahead` is true if the token may change with
+    the text after it, e.g., a string which is not closed.
+    """
+    n = len(text)
+    with unterminated.lexing(text):
+        while pos < n:
+            m = ROOT_TOKEN.match(text, pos)
+            kind = m.lastgroup
+            end = m.end()
+            if kind == "quote":
+                end, closed, lookahead = scan_string(text, end, m.group())
+                yield pos, end, STRING if closed else OTHER, lookahead
+            elif kind == "raw":
+                raw = match_raw_string(text, pos)
+                if raw:
+                    end = raw.end()
+                    yield pos, end, STRING, False
+                elif RAW_STRING_OPENER.match(text, pos):
+                    # the rest of the line is an error
+                    i = text.find("\n", pos)
+                    end = n if i < 0 else i + 1
+                    yield pos, end, OTHER, True
+                else:
+                    # a name
+                    yield pos, end, OTHER, False
+            elif kind == "space":
+                yield pos, end, SPACE, False
+            elif text[pos] == "`":
+                # a name starting with a backtick, unless it is quoted by backticks
+                yield pos, end, OTHER, not (
+                    kind == "name" and end - pos > 1 and text[end - 1] == "`")
+            else:
+                lookahead = (
+                    text[pos] == "%" and kind != "operator" or
+                    text[pos] == "_" and UNDERSCORE_CALL.match(text, pos) is not None)
+                yield pos, end, OTHER, lookahead
+            pos = end
+
+
+class StringContext():
+    """
+    Track the line starts of a document which are outside of the strings, the comments and
+    the other tokens of `CustomSLexer`. When the document is edited, it is scanned from the
+    line before the change, or from a token before the change which depends on the text
+    after it, such as a string which is not closed, until a line start after the change is
+    outside of the tokens again. `cursor_in_string` only scans from the line start before
+    the cursor.
+    """
+    def __init__(self):
+        self._lines = []
+        # whether each line starts outside of the tokens
+        self._starts = []
+        # the lines with a token which may change with the text after it, sorted
+        self._lookaheads = []
+        self._lock = threading.RLock()
+
+    def update(self, document):
+        """
+        Scan the changes of a new document.
+        """
+        with self._lock:
+            lines = document.lines
+            if lines is not self._lines and lines != self._lines:
+                self._update(document)
+
+    def _update(self, document):
+        lines = document.lines
+        old_lines = self._lines
+        old_starts = self._starts
+        n = len(lines)
+        m = len(old_lines)
+        limit = min(n, m)
+        p = 0
+        while p < limit and lines[p] == old_lines[p]:
+            p += 1
+        s = 0
+        while s < limit - p and lines[n - 1 - s] == old_lines[m - 1 - s]:
+            s += 1
+
+        c = max(p - 1, 0)
+        if self._lookaheads and self._lookaheads[0] < c:
+            c = self._lookaheads[0]
+        while c > 0 and not old_starts[c]:
+            c -= 1
+        starts = old_starts[:c]
+        starts.append(True)
+        lookaheads = self._lookaheads[:bisect_left(self._lookaheads, c)]
+
+        # the lines of the common suffix are the lines of the old document shifted by `delta`
+        converge = n - s
+        delta = m - n
+        text = document.text
+        line = c
+        offset = document.translate_row_col_to_index(c, 0)
+        # the offset of the start of the next line
+        next_start = offset + len(lines[c]) + 1 if c + 1 < n else None
+        for start, end, kind, lookahead in scan(text, offset):
+            while next_start is not None and next_start <= start:
+                line += 1
+                starts.append(True)
+                if line >= converge and old_starts[line + delta]:
+                    starts.extend(old_starts[line + delta + 1:])
+                    lookaheads.extend(
+                        k - delta for k in self._lookaheads if k >= line + delta)
+                    break
+                next_start = next_start + len(lines[line]) + 1 if line + 1 < n else None
+            else:
+                if lookahead and (not lookaheads or lookaheads[-1] != line):
+                    lookaheads.append(line)
+                while next_start is not None and next_start < end:
+                    line += 1
+                    starts.append(kind == SPACE)
+                    next_start = next_start + len(lines[line]) + 1 if line + 1 < n else None
+                continue
+            break
         else:
+            starts.extend(True for _ in range(len(starts), n))
+
+        self._lines = lines
+        self._starts = starts
+        self._lookaheads = lookaheads
+
+    def cursor_in_string(self, document):
+        """
+        Whether the text before the cursor, without trailing spaces, ends with a string,
+        as lexed by `CustomSLexer`.
+        """
+        lines = document.lines
+        row = document.cursor_position_row
+        text = lines[row][:document.cursor_position_col].rstrip()
+        while not text and row > 0:
+            row -= 1
+            text = lines[row].rstrip()
+        if not text:
             return False
-    return False
+        with self._lock:
+            self.update(document)
+            start = row
+            while start > 0 and not self._starts[start]:
+                start -= 1
+        offset = document.translate_row_col_to_index(start, 0)
+        text = document.text[offset:document.translate_row_col_to_index(row, len(text))]
+        kind = None
+        for _, _, kind, _ in scan(text):
+            pass
+        return kind == STRING
+
+
+string_context = StringContext()
+
+_cursor_in_string_cache = SimpleCache(maxsize=8)
+
+
+def cursor_in_string(document):
+    return _cursor_in_string_cache.get(
+        (document.text, document.cursor_position),
+        lambda: string_context.cursor_in_string(document))
@@ -343,11 +343,13 @@ def create_key_bindings():
     @handle('enter', filter=insert_mode & default_focused & completion_is_selected)
     def _(event):
         event.current_buffer.complete_state = None
+        event.current_buffer.stop_fuzzy_search()
 
     # cancel completion
     @handle('c-c', filter=default_focused & has_completions)
     def _(event):
         event.current_buffer.cancel_completion()
+        event.current_buffer.stop_fuzzy_search()
 
     # new line
     @handle('escape', 'enter', filter=emacs_insert_mode)
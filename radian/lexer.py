@@ -1,8 +1,11 @@
 # -*- coding: utf-8 -*-
 
 import re
+import threading
+from contextlib import contextmanager
 
-from pygments.lexer import Lexer, RegexLexer, include, words, do_insertions, bygroups
+from pygments.lexer import Lexer, RegexLexer, RegexLexerMeta, include, words, do_insertions, \
+    bygroups
 from pygments.token import Text, Comment, Operator, Keyword, Name, String, \
     Number, Punctuation, Generic
 
@@ -10,7 +13,130 @@ from pygments.token import Text, Comment, Operator, Keyword, Name, String, \
 line_re = re.compile('.*?\n')
 
 
-class CustomSLexer(RegexLexer):
+RAW_STRING_OPENER = re.compile(r'[rR]([\'"])(-*)([(\[{])')
+CLOSING_BRACKETS = {'(': ')', '[': ']', '{': '}'}
+DASHES = re.compile('-*')
+
+
+class RawStringMatch():
+    """
+    A raw string found by `match_raw_string`, quacking like a `re.Match`.
+    """
+    def __init__(self, string, pos, body, endpos):
+        self.string = string
+        self.pos = pos
+        self.body = body
+        self.endpos = endpos
+
+    def start(self):
+        return self.pos
+
+    def end(self):
+        return self.endpos
+
+    def group(self):
+        return self.string[self.pos:self.endpos]
+
+
+class UnterminatedRawStrings():
+    """
+    The closers of raw strings which are not found in the texts being lexed, with the
+    position after which they are not found, so that a run of unterminated openers stays
+    linear. A text is only registered, by its id, while it is lexed, so that it isn't kept
+    alive after it is lexed.
+    """
+    def __init__(self):
+        # the number of runs lexing the text and the positions by the closer, by the text id
+        self._texts = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def lexing(self, text):
+        key = id(text)
+        with self._lock:
+            entry = self._texts.setdefault(key, [0, {}])
+            entry[0] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                entry[0] -= 1
+                if not entry[0]:
+                    del self._texts[key]
+
+    def get(self, text):
+        """
+        Get the positions after which the closers are not found in `text`, by the closer,
+        `None` if `text` is not being lexed.
+        """
+        entry = self._texts.get(id(text))
+        return entry[1] if entry else None
+
+
+unterminated = UnterminatedRawStrings()
+
+
+def match_raw_string(text, pos):
+    """
+    Match a raw string at `pos`. The closer is found by a string search, instead of a lazy
+    regex which backtracks on an unterminated raw string.
+    """
+    m = RAW_STRING_OPENER.match(text, pos)
+    if not m:
+        return None
+    quote, dashes, bracket = m.groups()
+    body = m.end()
+    # four or more dashes close a raw string opened by four or more dashes
+    closer = CLOSING_BRACKETS[bracket] + dashes[:4] + quote
+    missing = unterminated.get(text)
+    if missing is not None and missing.get(closer, len(text) + 1) <= body:
+        return None
+
+    if len(dashes) < 4:
+        i = text.find(closer, body)
+        if i >= 0:
+            return RawStringMatch(text, pos, body, i + len(closer))
+    else:
+        i = text.find(closer[:-1], body)
+        while i >= 0:
+            j = DASHES.match(text, i + len(closer) - 1).end()
+            if text.startswith(quote, j):
+                return RawStringMatch(text, pos, body, j + 1)
+            i = text.find(closer[:-1], j)
+    if missing is not None:
+        missing[closer] = body
+    return None
+
+
+def raw_string(lexer, m):
+    yield m.start(), String, m.string[m.start():m.body]
+    yield m.body, String, m.string[m.body:m.end()]
+
+
+class CustomSLexerMeta(RegexLexerMeta):
+    """
+    Allow a function of `(text, pos)` returning a match in place of a regex.
+    """
+    def _process_regex(cls, regex, rflags, state):
+        if callable(regex):
+            return regex
+        return super()._process_regex(regex, rflags, state)
+
+
+class RawStringLexer(RegexLexer, metaclass=CustomSLexerMeta):
+    """
+    A lexer with the rule `match_raw_string`. A text is lexed within `lexing(text)`.
+    """
+    @staticmethod
+    def lexing(text):
+        return unterminated.lexing(text)
+
+    def get_tokens_unprocessed(self, text, stack=('root',)):
+        with self.lexing(text):
+            yield from super().get_tokens_unprocessed(text, stack)
+
+
+class CustomSLexer(RawStringLexer):
     """
     For S, S-plus, and R source code.
 
@@ -69,37 +195,11 @@ class CustomSLexer(RegexLexer):
             # whitespaces
             (r'\s+', Text),
             (r'\'', String, 'string_squote'),
-            (r'(r|R)\'\(', String, 'string_squote_r'),
-            (r'(r|R)\'\[', String, 'string_squote_s'),
-            (r'(r|R)\'\{', String, 'string_squote_c'),
-            (r'(r|R)\'-\(', String, 'string_squote_r1'),
-            (r'(r|R)\'-\[', String, 'string_squote_s1'),
-            (r'(r|R)\'-\{', String, 'string_squote_c1'),
-            (r'(r|R)\'--\(', String, 'string_squote_r2'),
-            (r'(r|R)\'--\[', String, 'string_squote_s2'),
-            (r'(r|R)\'--\{', String, 'string_squote_c2'),
-            (r'(r|R)\'---\(', String, 'string_squote_r3'),
-            (r'(r|R)\'---\[', String, 'string_squote_s3'),
-            (r'(r|R)\'---\{', String, 'string_squote_c3'),
-            (r'(r|R)\'-{4,}\(', String, 'string_squote_r4'),
-            (r'(r|R)\'-{4,}\[', String, 'string_squote_s4'),
-            (r'(r|R)\'-{4,}\{', String, 'string_squote_c4'),
             (r'\"', String, 'string_dquote'),
-            (r'(r|R)\"\(', String, 'string_dquote_r'),
-            (r'(r|R)\"\[', String, 'string_dquote_s'),
-            (r'(r|R)\"\{', String, 'string_dquote_c'),
-            (r'(r|R)\"-\(', String, 'string_dquote_r1'),
-            (r'(r|R)\"-\[', String, 'string_dquote_s1'),
-            (r'(r|R)\"-\{', String, 'string_dquote_c1'),
-            (r'(r|R)\"--\(', String, 'string_dquote_r2'),
-            (r'(r|R)\"--\[', String, 'string_dquote_s2'),
-            (r'(r|R)\"--\{', String, 'string_dquote_c2'),
-            (r'(r|R)\"---\(', String, 'string_dquote_r3'),
-            (r'(r|R)\"---\[', String, 'string_dquote_s3'),
-            (r'(r|R)\"---\{', String, 'string_dquote_c3'),
-            (r'(r|R)\"-{4,}\(', String, 'string_dquote_r4'),
-            (r'(r|R)\"-{4,}\[', String, 'string_dquote_s4'),
-            (r'(r|R)\"-{4,}\{', String, 'string_dquote_c4'),
+            # raw strings, e.g., r"(...)", r'[...]' or r"--{...}--"
+            (match_raw_string, raw_string),
+            # an unterminated raw string
+            (r'[rR][\'"]-*[(\[{]', String, 'string_raw'),
             include('builtin_symbols'),
             include('valid_name'),
             include('numbers'),
@@ -120,101 +220,49 @@ class CustomSLexer(RegexLexer):
         'string_squote': [
             (r'([^\'\\]|\\.)*\'', String, '#pop'),
         ],
-        'string_squote_r': [
-            (r'(.|\n)*?\)\'', String, '#pop'),
-        ],
-        'string_squote_s': [
-            (r'(.|\n)*?\]\'', String, '#pop'),
-        ],
-        'string_squote_c': [
-            (r'(.|\n)*?\}\'', String, '#pop'),
-        ],
-        'string_squote_r1': [
-            (r'(.|\n)*?\)-\'', String, '#pop'),
-        ],
-        'string_squote_s1': [
-            (r'(.|\n)*?\]-\'', String, '#pop'),
-        ],
-        'string_squote_c1': [
-            (r'(.|\n)*?\}-\'', String, '#pop'),
-        ],
-        'string_squote_r2': [
-            (r'(.|\n)*?\)--\'', String, '#pop'),
-        ],
-        'string_squote_s2': [
-            (r'(.|\n)*?\]--\'', String, '#pop'),
-        ],
-        'string_squote_c2': [
-            (r'(.|\n)*?\}--\'', String, '#pop'),
-        ],
-        'string_squote_r3': [
-            (r'(.|\n)*?\)---\'', String, '#pop'),
-        ],
-        'string_squote_s3': [
-            (r'(.|\n)*?\]---\'', String, '#pop'),
-        ],
-        'string_squote_c3': [
-            (r'(.|\n)*?\}---\'', String, '#pop'),
-        ],
-        'string_squote_r4': [
-            (r'(.|\n)*?\)-{4,}\'', String, '#pop'),
-        ],
-        'string_squote_s4': [
-            (r'(.|\n)*?\]-{4,}\'', String, '#pop'),
-        ],
-        'string_squote_c4': [
-            (r'(.|\n)*?\}-{4,}\'', String, '#pop'),
-        ],
         'string_dquote': [
             (r'([^"\\]|\\.)*"', String, '#pop'),
         ],
-        'string_dquote_r': [
-            (r'(.|\n)*?\)\"', String, '#pop'),
-        ],
-        'string_dquote_s': [
-            (r'(.|\n)*?\]\"', String, '#pop'),
-        ],
-        'string_dquote_c': [
-            (r'(.|\n)*?\}\"', String, '#pop'),
-        ],
-        'string_dquote_r1': [
-            (r'(.|\n)*?\)-\"', String, '#pop'),
-        ],
-        'string_dquote_s1': [
-            (r'(.|\n)*?\]-\"', String, '#pop'),
-        ],
-        'string_dquote_c1': [
-            (r'(.|\n)*?\}-\"', String, '#pop'),
-        ],
-        'string_dquote_r2': [
-            (r'(.|\n)*?\)--\"', String, '#pop'),
-        ],
-        'string_dquote_s2': [
-            (r'(.|\n)*?\]--\"', String, '#pop'),
-        ],
-        'string_dquote_c2': [
-            (r'(.|\n)*?\}--\"', String, '#pop'),
-        ],
-        'string_dquote_r3': [
-            (r'(.|\n)*?\)---\"', String, '#pop'),
-        ],
-        'string_dquote_s3': [
-            (r'(.|\n)*?\]---\"', String, '#pop'),
-        ],
-        'string_dquote_c3': [
-            (r'(.|\n)*?\}---\"', String, '#pop'),
-        ],
-        'string_dquote_r4': [
-            (r'(.|\n)*?\)-{4,}\"', String, '#pop'),
-        ],
-        'string_dquote_s4': [
-            (r'(.|\n)*?\]-{4,}\"', String, '#pop'),
-        ],
-        'string_dquote_c4': [
-            (r'(.|\n)*?\}-{4,}\"', String, '#pop'),
-        ],
+        # no rule matches, so the rest of the line is an error
+        'string_raw': [],
     }
 
     def analyse_text(text):
         if re.search(r'[a-z0-9_\])\s]<-(?!-)', text):
             return 0.11
+
+    @staticmethod
+    def lookahead(token, value):
+        """
+        Whether a token may change with the text after its line: a name starting with a
+        backtick which is not closed, or the "%" of an operator which is not closed.
+        """
+        return (value[0] == "`" and (len(value) == 1 or value[-1] != "`") or value == "%") and \
+            token not in String
+
+
+class StringSLexer(RawStringLexer):
+    """
+    Only the comments and the strings of R code, for the documents which are too large to be
+    highlighted by `CustomSLexer`.
+    """
+
+    name = 'S strings'
+
+    tokens = {
+        'root': [
+            (r'#.*$', Comment.Single),
+            (r'\'', String, 'string_squote'),
+            (r'\"', String, 'string_dquote'),
+            (match_raw_string, raw_string),
+            (r'[rR][\'"]-*[(\[{]', String, 'string_raw'),
+            # names, so that a name ending with "r" does not start a raw string
+            (CustomSLexer.valid_name, Text),
+            (r'[^#\'"`\w.]+|[0-9]+|.', Text),
+        ],
+        'string_squote': CustomSLexer.tokens['string_squote'],
+        'string_dquote': CustomSLexer.tokens['string_dquote'],
+        'string_raw': [],
+    }
+
+    lookahead = staticmethod(CustomSLexer.lookahead)
@@ -0,0 +1,144 @@
+from prompt_toolkit.auto_suggest import AutoSuggest, Suggestion
+
+
+# a node of the radix trie is a list of the edge label leading to it, the newest line
+# below it and a dict of its children by the first character of their labels
+LABEL, BEST, CHILDREN = range(3)
+
+
+def _new_node(label, best):
+    return [label, best, None]
+
+
+def trie_insert(root, line, newest):
+    """
+    Insert `line` into the radix trie `root`. If `newest` is true, the line is newer
+    than every line in the trie, otherwise it is older.
+    """
+    node = root
+    i = 0
+    while True:
+        if newest or node[BEST] is None:
+            node[BEST] = line
+        if i == len(line):
+            return
+        children = node[CHILDREN]
+        if children is None:
+            children = node[CHILDREN] = {}
+        child = children.get(line[i])
+        if child is None:
+            children[line[i]] = _new_node(line[i:], line)
+            return
+        label = child[LABEL]
+        j = 1
+        n = min(len(label), len(line) - i)
+        while j < n and label[j] == line[i + j]:
+            j += 1
+        if j < len(label):
+            # split the edge
+            parent = _new_node(label[:j], child[BEST])
+            parent[CHILDREN] = {label[j]: child}
+            child[LABEL] = label[j:]
+            children[line[i]] = child = parent
+        node = child
+        i += j
+
+
+def trie_lookup(root, prefix):
+    """
+    Get the newest line in the radix trie `root` which starts with `prefix`.
+    """
+    node = root
+    i = 0
+    while i < len(prefix):
+        children = node[CHILDREN]
+        if not children:
+            return None
+        child = children.get(prefix[i])
+        if child is None:
+            return None
+        label = child[LABEL]
+        if prefix.startswith(label, i):
+            i += len(label)
+            node = child
+        elif label.startswith(prefix[i:]):
+            return child[BEST]
+        else:
+            return None
+    return node[BEST]
+
+
+class AutoSuggestFromHistory(AutoSuggest):
+    """
+    Give suggestions based on the lines in the history book of the current mode.
+    The lines are kept in a radix trie per history book, so that a suggestion is found
+    in time proportional to the length of the input. New entries are added as they are
+    appended, older entries are added, newest first, only until a suggestion is found.
+    """
+    chunk_size = 1000
+    # older entries added per keystroke at most, so that typing isn't blocked
+    # until the whole history is in the tries
+    max_chunks = 4
+
+    def __init__(self):
+        self._history = None
+        self._tries = {}
+        # the entries from `_oldest` to `_newest` are in the tries
+        self._oldest = 0
+        self._newest = 0
+
+    def _book(self, session, mode):
+        spec = session.specs.get(mode)
+        return spec.history_book if spec else None
+
+    def _add(self, session, entry, newest):
+        mode, string = entry
+        book = self._book(session, mode)
+        if book is None:
+            return
+        try:
+            root = self._tries[book]
+        except KeyError:
+            root = self._tries[book] = _new_node("", None)
+        lines = string.splitlines()
+        # the last line of an entry is preferred
+        for line in lines if newest else reversed(lines):
+            trie_insert(root, line, newest)
+
+    def _update(self, buffer):
+        history = buffer.history
+        n = history.count()
+        if history is not self._history:
+            self._history = history
+            self._tries = {}
+            self._oldest = self._newest = n
+        for i in range(self._newest, n):
+            self._add(buffer.session, history.get_entry(i), True)
+        self._newest = n
+
+    def _add_older(self, buffer):
+        history = buffer.history
+        start = max(self._oldest - self.chunk_size, 0)
+        for i in range(self._oldest - 1, start - 1, -1):
+            self._add(buffer.session, history.get_entry(i), False)
+        self._oldest = start
+
+    def get_suggestion(self, buffer, document):
+        # Consider only the last line for the suggestion.
+        text = document.text.rsplit("\n", 1)[-1]
+
+        # Only create a suggestion when this is not an empty line.
+        if not text.strip():
+            return None
+
+        self._update(buffer)
+        book = buffer.session.current_mode_spec.history_book
+        for _ in range(self.max_chunks + 1):
+            root = self._tries.get(book)
+            line = trie_lookup(root, text) if root else None
+            if line is not None:
+                return Suggestion(line[len(text):])
+            if self._oldest == 0:
+                break
+            self._add_older(buffer)
+        return None
@@ -3,12 +3,83 @@ from prompt_toolkit.buffer import Buffer
 from prompt_toolkit.search import SearchState, SearchDirection
 from prompt_toolkit.document import Document
 
-from collections import deque
+from .fuzzy import FuzzyHistoryCompleter
+
+from bisect import bisect_left
+from collections import OrderedDict
+from heapq import merge
+from itertools import chain
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def _walk(run, start, stop, step):
+    for j in range(start, stop, step):
+        yield run[j]
+
+
+def _unique(indices):
+    last = None
+    for i in indices:
+        if i != last:
+            yield i
+            last = i
+
+
+class WorkingLines:
+    """
+    A view of the history entries followed by the current input, used as
+    the working lines of a buffer. Changes made to the history entries are kept
+    in the view, the history itself is not copied or modified.
+    """
+    def __init__(self, history, text):
+        self.history = history
+        self.current = text
+        self._edited = {}
+
+    def __len__(self):
+        return self.history.count() + 1
+
+    def _index(self, i):
+        n = self.history.count()
+        if i < 0:
+            i += n + 1
+        if i < 0 or i > n:
+            raise IndexError("working lines index out of range")
+        return i, n
+
+    def __getitem__(self, i):
+        i, n = self._index(i)
+        if i == n:
+            return self.current
+        try:
+            return self._edited[i]
+        except KeyError:
+            return self.history.get_entry(i)[1]
+
+    def __setitem__(self, i, text):
+        i, n = self._index(i)
+        if i == n:
+            self.current = text
+        else:
+            self._edited[i] = text
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @property
+    def edited(self):
+        return self._edited.keys()
+
+    def mode(self, i):
+        i, n = self._index(i)
+        if i == n:
+            return None
+        return self.history.get_entry(i)[0]
+
+
 class BetterBuffer(Buffer):
     def __init__(self, *args, search_no_duplicates, **kwargs):
         self.search_no_duplicates = search_no_duplicates
@@ -18,7 +89,8 @@ class BetterBuffer(Buffer):
         self._in_search = False
         self._last_search_direction = None
         self._last_search_history = None
-        self._search_history = []
+        # the visited search results, used as an ordered set
+        self._search_history = OrderedDict()
         super().__init__(*args, **kwargs)
         original_accept_handler = self.accept_handler
 
@@ -38,6 +110,34 @@ class BetterBuffer(Buffer):
         no_duplicates = self.search_no_duplicates
         return not no_duplicates or self._working_lines[i] not in self._search_history
 
+    def _search_candidates(self, text):
+        """
+        Sorted runs of the working indices which may contain `text`, or `None` for all of them.
+        """
+        return None
+
+    def _search_indices(self, working_index, direction, candidates):
+        # the order of a linear search, which wraps around to the first or last line
+        n = len(self._working_lines)
+        if direction == SearchDirection.FORWARD:
+            if candidates is None:
+                return (i % n for i in range(working_index + 1, n + 1))
+            wrap = 0
+            indices = merge(*[
+                _walk(run, bisect_left(run, working_index + 1), len(run), 1)
+                for run in candidates])
+        else:
+            if candidates is None:
+                return (i % n for i in range(working_index - 1, -2, -1))
+            wrap = n - 1
+            indices = merge(*[
+                _walk(run, bisect_left(run, working_index) - 1, -1, -1)
+                for run in candidates], reverse=True)
+
+        if any(run and wrap in (run[0], run[-1]) for run in candidates):
+            indices = chain(indices, [wrap])
+        return _unique(indices)
+
     def _search(
         self,
         search_state: SearchState,
@@ -54,10 +154,12 @@ class BetterBuffer(Buffer):
         # added by radian
         if direction != self._last_search_direction:
             self._last_search_history = None
-            self._search_history = []
+            self._search_history = OrderedDict()
 
         self._in_search = True
 
+        candidates = self._search_candidates(text)
+
         def search_once(
             working_index: int, document: Document
         ):
@@ -82,10 +184,8 @@ class BetterBuffer(Buffer):
                     # No match, go forward in the history. (Include len+1 to wrap around.)
                     # (Here we should always include all cursor positions, because
                     # it's a different line.)
-                    for i in range(working_index + 1, len(self._working_lines) + 1):
-                        i %= len(self._working_lines)
-
-                        # modified by radian
+                    # modified by radian, only visit the candidates
+                    for i in self._search_indices(working_index, direction, candidates):
                         if self._search_matches(i):
                             document = Document(self._working_lines[i], 0)
                             new_index = document.find(text, include_current_position=True,
@@ -103,10 +203,8 @@ class BetterBuffer(Buffer):
                     )
                 else:
                     # No match, go back in the history. (Include -1 to wrap around.)
-                    for i in range(working_index - 1, -2, -1):
-                        i %= len(self._working_lines)
-
-                        # modified by radian
+                    # modified by radian, only visit the candidates
+                    for i in self._search_indices(working_index, direction, candidates):
                         if self._search_matches(i):
                             document = Document(self._working_lines[i], len(self._working_lines[i]))
                             new_index = document.find_backwards(
@@ -131,13 +229,13 @@ class BetterBuffer(Buffer):
         else:
             self._last_search_direction = None
             self._last_search_history = None
-            self._search_history = []
+            self._search_history = OrderedDict()
             return None
 
     def apply_search(self, *args, **kwargs):
         super().apply_search(*args, **kwargs)
         if self._last_search_history and self._last_search_history not in self._search_history:
-            self._search_history.append(self._last_search_history)
+            self._search_history[self._last_search_history] = None
         self._in_search = False
 
     def go_to_next_history(self, i):
@@ -172,7 +270,7 @@ class BetterBuffer(Buffer):
         self._in_search = False
         self._last_search_direction = None
         self._last_search_history = None
-        self._search_history = []
+        self._search_history = OrderedDict()
 
     def reset(self, *args, **kwargs):
         self._reset_searching()
@@ -182,6 +280,11 @@ class BetterBuffer(Buffer):
 class ModalBuffer(BetterBuffer):
     def __init__(self, *args, session, **kwargs):
         self.session = session
+        # whether the input is completed by the fuzzy history search
+        self.fuzzy_search = False
+        self.fuzzy_completer = FuzzyHistoryCompleter(self)
+        self._book_modes_key = None
+        self._book_modes = frozenset()
         super().__init__(*args, **kwargs)
         # we don't use load_history_if_not_yet_loaded because it breaks ctrl-o
         # https://github.com/prompt-toolkit/python-prompt-toolkit
@@ -192,28 +295,95 @@ class ModalBuffer(BetterBuffer):
     #         self.working_mode = self.session.current_mode
 
     # def _change_working_mode(self, index):
-    #     if index < len(self._working_lines_mode) - 1:
-    #         mode = self._working_lines_mode[index]
+    #     if index < len(self._working_lines) - 1:
+    #         mode = self._working_lines.mode(index)
     #         self.session.activate_mode(mode)
     #     elif self.working_mode:
     #         self.session.activate_mode(self.working_mode)
 
+    def book_modes(self):
+        """
+        The modes of which the entries are in the history book of the current mode.
+        """
+        spec = self.session.current_mode_spec
+        specs = self.session.specs
+        key = (spec, tuple(specs.values()))
+        if key != self._book_modes_key:
+            self._book_modes_key = key
+            self._book_modes = frozenset([spec.name] + [
+                name for name, s in specs.items() if s.history_book == spec.history_book])
+        return self._book_modes
+
+    def history_book_matches(self, mode):
+        """
+        Whether the entries of `mode` are in the history book of the current mode.
+        """
+        return mode in self.book_modes()
+
     def _history_mode_matches(self, i):
         if i == len(self._working_lines) - 1:
             return True
-        else:
-            spec = self.session.current_mode_spec
-            next_mode = self._working_lines_mode[i]
-            if next_mode == spec.name:
-                return True
-            elif next_mode in self.session.specs and \
-                    spec.history_book == self.session.specs[next_mode].history_book:
-                return True
-        return False
+        return self.history_book_matches(self._working_lines.mode(i))
 
     def _history_matches(self, i):
         return super()._history_matches(i) and self._history_mode_matches(i)
 
+    def _book_indices(self, working_index, direction):
+        """
+        The working indices of the entries in the history book of the current mode,
+        after or before `working_index`, or `None` if the history has no index of them.
+        """
+        runs = []
+        for mode in self.book_modes():
+            positions = self.history.mode_positions(mode)
+            if positions is None:
+                return None
+            runs.append(positions)
+        if direction > 0:
+            indices = merge(*[
+                _walk(run, bisect_left(run, working_index + 1), len(run), 1) for run in runs])
+            # the current input
+            return chain(indices, [len(self._working_lines) - 1])
+        return merge(*[
+            _walk(run, bisect_left(run, working_index) - 1, -1, -1) for run in runs],
+            reverse=True)
+
+    def history_forward(self, count=1):
+        # only visit the entries of the history book
+        indices = self._book_indices(self.working_index, 1)
+        if indices is None:
+            return super().history_forward(count)
+        self._set_history_search()
+        found_something = False
+        for i in indices:
+            if i <= self.working_index:
+                continue
+            if self._history_matches(i):
+                self.working_index = i
+                count -= 1
+                found_something = True
+            if count == 0:
+                break
+        if found_something:
+            self.cursor_position = 0
+            self.cursor_position += self.document.get_end_of_line_position()
+
+    def history_backward(self, count=1):
+        indices = self._book_indices(self.working_index, -1)
+        if indices is None:
+            return super().history_backward(count)
+        self._set_history_search()
+        found_something = False
+        for i in indices:
+            if self._history_matches(i):
+                self.working_index = i
+                count -= 1
+                found_something = True
+            if count == 0:
+                break
+        if found_something:
+            self.cursor_position = len(self.text)
+
     def load_history_if_not_yet_loaded(self):
         # use _reset_history instead
         pass
@@ -221,6 +391,14 @@ class ModalBuffer(BetterBuffer):
     def _search_matches(self, i):
         return super()._search_matches(i) and self._history_mode_matches(i)
 
+    def _search_candidates(self, text):
+        candidates = self.history.search_candidates(text)
+        if candidates is None:
+            return None
+        n = len(self._working_lines)
+        # edited entries and the current input are not indexed
+        return [candidates, sorted(set(self._working_lines.edited).union([n - 1]))]
+
     def _search(self, *args, **kwargs):
         # self._set_working_mode()
         res = super()._search(*args, **kwargs)
@@ -244,21 +422,38 @@ class ModalBuffer(BetterBuffer):
         if not self.session.current_mode_spec.keep_history:
             return
         if self.text:
-            history_strings = self.history.get_strings()
-            history_modes = self.history.get_modes()
-            if not len(history_strings) or \
-                    history_strings[-1] != self.text or \
-                    history_modes[-1] != self.session.current_mode:
+            entry = (self.session.current_mode, self.text)
+            if self.history.last_entry() != entry:
                 self.history.append_string(self.text, self.session.current_mode)
 
+    def start_fuzzy_search(self):
+        self.fuzzy_search = True
+        self.start_completion(select_first=False)
+
+    def stop_fuzzy_search(self):
+        self.fuzzy_search = False
+
+    def refresh_history(self):
+        """
+        Pick up the history entries added by other sessions.
+        Return whether there are new entries.
+        """
+        at_current_line = self._is_last_history()
+        if not self.history.refresh():
+            return False
+        if at_current_line:
+            # the new entries are inserted before the current input
+            self._Buffer__working_index = len(self._working_lines) - 1
+        return True
+
     def _reset_history(self):
-        self._working_lines_mode = deque([None])
         self.working_mode = None
-        for m, item in self.history.load():
-            self._working_lines.appendleft(item)
-            self._working_lines_mode.appendleft(m)
-            self._Buffer__working_index += 1
+        # the history is not copied, new entries are seen through the view
+        self._working_lines = WorkingLines(self.history, self.text)
+        self._Buffer__working_index = len(self._working_lines) - 1
 
     def reset(self, *args, **kwargs):
+        self.fuzzy_search = False
         super().reset(*args, **kwargs)
+        self.history.refresh()
         self._reset_history()
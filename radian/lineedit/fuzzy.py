@@ -0,0 +1,106 @@
+import re
+from itertools import count
+
+from prompt_toolkit.completion import Completer, Completion
+
+
+# characters after which a match starts a new word
+WORD_BOUNDARY = set(" \t\n()[]{},;:=<>-+*/\\$@._\"'|&!~^%")
+
+
+def fuzzy_pattern(query):
+    """
+    A regular expression which matches if the characters of `query` appear in order.
+    Case is ignored, unless the query contains upper case characters.
+    """
+    flags = 0 if query != query.lower() else re.IGNORECASE
+    return re.compile(".*?".join(re.escape(c) for c in query), flags | re.DOTALL)
+
+
+def fuzzy_score(query, text):
+    """
+    Score the match of `query` in `text`, higher is better. Matches at the start of words
+    and consecutive matches are preferred, gaps are penalized. Return `None` if the
+    characters of `query` don't appear in `text` in order.
+    """
+    if query == query.lower():
+        text = text.lower()
+    n = len(query)
+    if not n:
+        return 0
+
+    # find the end of the first match, then the shortest match ending there
+    end = -1
+    for c in query:
+        end = text.find(c, end + 1)
+        if end < 0:
+            return None
+    positions = [0] * n
+    start = end + 1
+    for i in range(n - 1, -1, -1):
+        start = positions[i] = text.rfind(query[i], 0, start)
+
+    score = 0
+    last = -2
+    chunk_bonus = 0
+    for p in positions:
+        bonus = 8 if p == 0 or text[p - 1] in WORD_BOUNDARY else 0
+        if p == last + 1:
+            # a run of consecutive matches keeps the bonus of its first character
+            bonus = max(bonus, chunk_bonus) + 4
+        else:
+            chunk_bonus = bonus
+            if last >= 0:
+                score -= min(p - last - 1, 8)
+        score += 16 + bonus
+        last = p
+    return score
+
+
+class FuzzyHistoryCompleter(Completer):
+    """
+    Complete the input with the history entries of the current history book which fuzzily
+    match it. The history is scored from the newest entry in chunks, each chunk is ranked
+    and yielded as soon as it is scored. When the input changes, the scoring of the
+    previous input is abandoned at the next chunk.
+    """
+    chunk_size = 2000
+    max_results = 500
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self._generation = count()
+        self._current = None
+
+    def get_completions(self, document, complete_event):
+        query = document.text
+        if not query.strip():
+            return
+
+        generation = self._current = next(self._generation)
+        history = self.buffer.history
+        n = history.count()
+        pattern = fuzzy_pattern(query)
+        start_position = -len(document.text_before_cursor)
+        seen = set()
+        results = 0
+
+        for chunk_end in range(n, 0, -self.chunk_size):
+            if self._current != generation:
+                return
+            ranked = []
+            for i in range(chunk_end - 1, max(chunk_end - self.chunk_size, 0) - 1, -1):
+                mode, text = history.get_entry(i)
+                if text in seen or not pattern.search(text) or \
+                        not self.buffer.history_book_matches(mode):
+                    continue
+                seen.add(text)
+                ranked.append((-fuzzy_score(query, text), n - i, text))
+            ranked.sort()
+            for _, _, text in ranked:
+                lines = text.split("\n")
+                display = lines[0] + " ..." if len(lines) > 1 else lines[0]
+                yield Completion(text, start_position=start_position, display=display)
+                results += 1
+                if results >= self.max_results:
+                    return
@@ -1,26 +1,214 @@
 import datetime
+import mmap
+import re
 import os
+import calendar
+import atexit
+import logging
+import shutil
+import tempfile
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections.abc import Sequence
+from contextlib import contextmanager
 from prompt_toolkit.history import InMemoryHistory, FileHistory
 
+from .history_index import HistoryIndex, MODE_IN_TEXT, read_mode, read_time, \
+    decode_entry, locked, scan_entries, entry_digest
+from .history_store import CompactHistoryStrings
+from .index import TrigramIndex, ModeIndex, TimeIndex
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryStrings(Sequence):
+    """
+    The strings of the `(mode, string)` entries of a history, oldest first.
+    Entries are read when they are accessed.
+    """
+    def __init__(self, entries):
+        self._entries = entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[j] for j in range(*k.indices(len(self)))]
+        return self._entries[k][1]
+
 
 class ModelHistory:
-    def load(self):
+    # `_loaded_strings` holds the `(mode, string)` entries, oldest item first,
+    # so that new entries are appended at the end.
+
+    _search_index = None
+    _mode_index = None
+    _time_index = None
+    # when the added entries are written, see `flush`
+    durability = "immediate"
+
+    def load_if_not_yet_loaded(self):
         if not self._loaded:
-            self._loaded_strings = list(self.load_history_strings())
+            self._loaded_strings = self.load_history_entries()
             self._loaded = True
 
-        for item in self._loaded_strings:
+    def load(self):
+        self.load_if_not_yet_loaded()
+        # newest items first
+        for item in reversed(self._loaded_strings):
             yield item
 
+    def count(self):
+        self.load_if_not_yet_loaded()
+        return len(self._loaded_strings)
+
+    def get_entry(self, i):
+        """
+        Get the `(mode, string)` entry at position `i`. (Oldest item first.)
+        """
+        return self._loaded_strings[i]
+
+    def last_entry(self):
+        """
+        Get the most recent `(mode, string)` entry, or `None` if the history is empty.
+        """
+        self.load_if_not_yet_loaded()
+        if not len(self._loaded_strings):
+            return None
+        return self._loaded_strings[-1]
+
+    def load_history_entries(self):
+        entries = list(self.load_history_strings())
+        entries.reverse()
+        return CompactHistoryStrings(entries)
+
     def append_string(self, string: str, mode) -> None:
-        self._loaded_strings.insert(0, (mode, string))
+        self.load_if_not_yet_loaded()
+        self._add_entry(mode, string)
         self.store_string(string, mode)
 
+    def _add_entry(self, mode, string, timestamp=None):
+        self._loaded_strings.append((mode, string), time.time() if timestamp is None else timestamp)
+        if self._search_index is not None:
+            self._search_index.add(string)
+
+    def search_candidates(self, text):
+        """
+        Get the sorted positions of the entries which may contain `text` (ignoring case),
+        or `None` if every entry has to be searched.
+        """
+        if self._search_index is None:
+            self.load_if_not_yet_loaded()
+            # built on the first search, so that loading doesn't read every entry
+            index = TrigramIndex()
+            for _, string in self._loaded_strings:
+                index.add(string)
+            self._search_index = index
+        return self._search_index.candidates(text)
+
+    def mode_positions(self, mode):
+        """
+        Get the sorted positions of the entries of `mode`, or `None` if every entry has to
+        be visited to find them.
+        """
+        self.load_if_not_yet_loaded()
+        if self._mode_index is None:
+            # built on the first navigation
+            self._mode_index = ModeIndex()
+        index = self._mode_index
+        if len(index) < len(self._loaded_strings):
+            index.extend(self._loaded_strings.modes(len(index)))
+        return index.positions(mode)
+
+    def _update_time_index(self):
+        self.load_if_not_yet_loaded()
+        if self._time_index is None:
+            # built on the first query, so that loading doesn't read every timestamp
+            self._time_index = TimeIndex()
+        index = self._time_index
+        if len(index) < len(self._loaded_strings):
+            for timestamp in self._loaded_strings.timestamps(len(index)):
+                index.add(timestamp)
+        return index
+
+    def get_timestamp(self, i):
+        """
+        Get the time of the entry at position `i` in seconds since the epoch, 0 if unknown.
+        """
+        return self._update_time_index().timestamp(i)
+
+    def time_range(self, start=None, end=None):
+        """
+        Get the range of positions of the entries from time `start` to `end` (excluded),
+        in seconds since the epoch.
+        """
+        return self._update_time_index().range(start, end)
+
+    def find_entries(self, start=None, end=None, text=None):
+        """
+        Get the `(timestamp, mode, string)` entries from time `start` to `end` (excluded)
+        which contain `text` (ignoring case), oldest first.
+        """
+        index = self._update_time_index()
+        positions = index.range(start, end)
+        if text:
+            candidates = self.search_candidates(text)
+            if candidates is not None:
+                positions = candidates[
+                    bisect_left(candidates, positions.start):
+                    bisect_left(candidates, positions.stop)]
+            text = text.casefold()
+        entries = []
+        for i in positions:
+            timestamp = index.timestamp(i)
+            if start is not None and timestamp < start or end is not None and timestamp >= end:
+                continue
+            mode, string = self.get_entry(i)
+            if text and text not in string.casefold():
+                continue
+            entries.append((timestamp, mode, string))
+        return entries
+
+    def start_background_tasks(self):
+        """
+        Called once the first prompt is shown.
+        """
+        pass
+
+    def flush(self):
+        """
+        Write the entries which are not yet saved.
+        """
+        pass
+
+    def command_finished(self):
+        """
+        Called when the next prompt is shown after an entry was accepted.
+        """
+        pass
+
+    def dedup_history(self):
+        """
+        Remove the entries which occur again later with the same mode.
+        Return the number of entries removed.
+        """
+        return 0
+
+    def refresh(self):
+        """
+        Load the entries added by other sessions. Return whether there are new entries.
+        """
+        return False
+
     def get_strings(self):
-        return [s for _, s in reversed(self._loaded_strings)]
+        # used by yank-last-arg, which only reads the last entries
+        return HistoryStrings(self._loaded_strings)
 
     def get_modes(self):
-        return [m for m, _ in reversed(self._loaded_strings)]
+        return [m for m, _ in self._loaded_strings]
 
 
 class ModalInMemoryHistory(ModelHistory, InMemoryHistory):
@@ -28,16 +216,483 @@ class ModalInMemoryHistory(ModelHistory, InMemoryHistory):
         pass
 
 
+class LazyHistoryStrings(Sequence):
+    """
+    The `(mode, string)` entries of a history file, oldest first.
+    Entries of the file are read each time they are accessed, entries appended in this
+    session and entries removed from the file are kept in memory.
+    """
+    def __init__(self, f, count):
+        self._file = f
+        self._count = count
+        # the entries and the timestamps of the entries removed from the file
+        self._strings = {}
+        self._times = {}
+        self._appended = CompactHistoryStrings()
+        # number of bytes and of entries removed from the start of the file by compaction
+        self._cut = 0
+        self._trimmed = 0
+        # the position in the file of each entry, once entries were removed from the file
+        # by deduplication
+        self._positions = None
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self._count + len(self._appended)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[j] for j in range(*k.indices(len(self)))]
+        if k < 0:
+            k += len(self)
+        if k >= self._count:
+            return self._appended[k - self._count]
+        if k < 0:
+            raise IndexError("history index out of range")
+        try:
+            return self._strings[k]
+        except KeyError:
+            pass
+        with self._lock:
+            return self._read(k)
+
+    def mode(self, k):
+        if k >= self._count:
+            return self._appended.mode(k - self._count)
+        try:
+            return self._strings[k][0]
+        except KeyError:
+            pass
+        with self._lock:
+            return self._read_mode(k)
+
+    def modes(self, start=0):
+        for k in range(start, len(self)):
+            yield self.mode(k)
+
+    def timestamp(self, k):
+        if k >= self._count:
+            return self._appended.timestamp(k - self._count)
+        try:
+            return self._times[k]
+        except KeyError:
+            pass
+        with self._lock:
+            return self._read_time(k)
+
+    def timestamps(self, start=0):
+        for k in range(start, len(self)):
+            yield self.timestamp(k)
+
+    def _read(self, k):
+        raise NotImplementedError
+
+    def _read_mode(self, k):
+        raise NotImplementedError
+
+    def _read_time(self, k):
+        raise NotImplementedError
+
+    def _offset(self, k):
+        raise NotImplementedError
+
+    def _position(self, k):
+        return k if self._positions is None else self._positions[k]
+
+    def _rebase(self):
+        """
+        Locate the entries of the history file which was rewritten.
+        """
+        raise NotImplementedError
+
+    def _open(self, filename):
+        self._file = open(filename, "rb")
+
+    def _close(self):
+        self._file.close()
+
+    def append(self, entry, timestamp=0.0):
+        self._appended.append(entry, timestamp)
+
+    @contextmanager
+    def detached(self, file_id, cut=None, remap=None):
+        """
+        Release the history file while it is replaced by a copy without the first
+        `cut` bytes, or by a copy where the entry at the position `i` of the file is moved
+        to `remap(i)`, or removed if it is `None`. The entries which are removed are kept
+        in memory.
+        """
+        with self._lock:
+            if _file_id(self._file) != file_id:
+                # still reading a file which was replaced by another session
+                yield
+                return
+            positions = array("Q") if remap is not None else None
+            for k in range(self._count):
+                if k in self._times:
+                    # removed from the file before
+                    if positions is not None:
+                        positions.append(0)
+                    continue
+                if remap is not None:
+                    # the position in the file, after the entries removed by compaction
+                    i = remap(self._position(k) - self._trimmed)
+                    if i is None:
+                        self._keep(k)
+                        i = 0
+                    positions.append(i)
+                elif self._offset(k) - self._cut >= cut:
+                    break
+                else:
+                    self._keep(k)
+                    self._trimmed += 1
+            self._close()
+            try:
+                yield
+            finally:
+                self._open(self._file.name)
+            if remap is not None:
+                self._positions = positions
+                self._cut = 0
+                self._trimmed = 0
+                self._rebase()
+            else:
+                self._cut += cut
+
+    def _keep(self, k):
+        self._strings[k] = self._read(k)
+        self._times[k] = self._read_time(k)
+
+
+class IndexedHistoryStrings(LazyHistoryStrings):
+    """
+    The entries of a history file located by its sidecar index.
+    """
+    def __init__(self, f, index):
+        self._index = index
+        super().__init__(f, len(index))
+
+    def _offset(self, k):
+        return self._index.record(self._position(k))[2]
+
+    def _read(self, k):
+        _, _, offset, length = self._index.record(self._position(k))
+        mode = self._read_mode(k)
+        self._file.seek(offset - self._cut)
+        return (mode, decode_entry(self._file.read(length)))
+
+    def modes(self, start=0):
+        if self._positions is not None:
+            yield from super().modes(start)
+            return
+        # read from the index records in bulk
+        index = self._index
+        for k, raw in enumerate(index.raw_modes(start, self._count), start):
+            if raw == MODE_IN_TEXT:
+                yield self.mode(k)
+            else:
+                yield index.decode_mode(raw)
+        yield from self._appended.modes(max(start - self._count, 0))
+
+    def _read_mode(self, k):
+        i = self._position(k)
+        mode_bytes, _, offset, _ = self._index.record(i)
+        if mode_bytes.rstrip(b"\0") == MODE_IN_TEXT:
+            return read_mode(self._file, offset - self._cut)
+        return self._index.mode(i)
+
+    def _read_time(self, k):
+        return self._index.record(self._position(k))[1]
+
+    def _rebase(self):
+        self._index = HistoryIndex(self._index.filename)
+        self._index.load(self._file)
+
+
+# the first `+` line of an entry, at the start of the file or after a line without `+`
+ENTRY_START = re.compile(rb"\A\+|^(?:[^+\n][^\n]*)?\n\+", re.MULTILINE)
+# the end of the `+` lines of an entry
+ENTRY_END = re.compile(rb"\n(?!\+)")
+
+
+class MappedHistoryStrings(LazyHistoryStrings):
+    """
+    The entries of a memory mapped history file. Only the offsets of the entries are
+    located when the file is loaded, the entries are parsed when they are accessed.
+    """
+    def __init__(self, f):
+        self._map(f)
+        self._locate()
+        self._modes = {}
+        super().__init__(f, len(self._starts))
+
+    def _locate(self):
+        self._starts = array("Q", (m.end() - 1 for m in ENTRY_START.finditer(self._mm)))
+        if self._starts and not ENTRY_END.search(self._mm, self._starts[-1]):
+            # the last entry is incomplete
+            self._starts.pop()
+
+    def _map(self, f):
+        self._file = f
+        try:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # empty file
+            self._mm = b""
+
+    def _offset(self, k):
+        return self._starts[self._position(k)]
+
+    @property
+    def end(self):
+        # the end of the last complete entry
+        if not self._count:
+            return 0
+        return ENTRY_END.search(self._mm, self._starts[self._count - 1] - self._cut).start() + 1
+
+    def _read(self, k):
+        mm = self._mm
+        offset = self._offset(k) - self._cut
+        end = ENTRY_END.search(mm, offset).start() + 1
+        return (self._read_mode(k), decode_entry(mm[offset:end]))
+
+    def _read_mode(self, k):
+        mode = read_mode(self._mm, self._offset(k) - self._cut)
+        return self._modes.setdefault(mode, mode)
+
+    def _read_time(self, k):
+        return read_time(self._mm, self._offset(k) - self._cut)
+
+    def _rebase(self):
+        self._locate()
+
+    def _open(self, filename):
+        self._map(open(filename, "rb"))
+
+    def _close(self):
+        if self._mm:
+            self._mm.close()
+        self._file.close()
+
+
+def format_entry(mode, string, timestamp):
+    """
+    Format an entry of the history file, the time header is omitted if `timestamp` is 0.
+    Return `(mode, timestamp, header length, bytes)`.
+    """
+    header = "\n"
+    if timestamp:
+        header += "# time: %s UTC\n" % time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(timestamp))
+    header += "# mode: %s\n" % mode
+    body = "".join("+%s\n" % line for line in string.split("\n"))
+    return (mode, timestamp, len(header.encode("utf-8")), (header + body).encode("utf-8"))
+
+
+DURABILITY_MODES = ("immediate", "batched", "on-exit")
+
+
 class ModalFileHistory(ModelHistory, FileHistory):
-    def __init__(self, history_file, max_history_size):
+    """
+    `durability` controls when accepted entries are written to the history file:
+    "immediate" writes every entry before it is evaluated, "batched" writes them in a
+    background thread shortly after and "on-exit" keeps them until `flush` is called.
+    If `shared` is true, entries written by other sessions are picked up by `refresh`.
+    If `dedup` is true, only the most recent occurrence of each entry is kept when the file
+    is compacted.
+    """
+    # seconds to wait for more entries before a batch is written
+    batch_delay = 1.0
+
+    def __init__(
+            self, history_file, max_history_size, durability="immediate", shared=False,
+            dedup=False):
         self.max_history_size = max_history_size
+        self.durability = durability if durability in DURABILITY_MODES else "immediate"
+        self._index = HistoryIndex(history_file)
+        self._indexed = False
+        self._file_id = None
+        self._compaction_pending = False
+        self._out = None
+        self._pending = []
+        # guards `_pending` only, entries are added while a batch is written
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._pending_event = None
+        self.shared = shared
+        self.dedup = dedup
+        # the end of the entries read from the file, the file identity and
+        # the bytes before the end, used to find it again after compaction
+        self._tail = 0
+        self._tail_id = None
+        self._tail_marker = b""
+        self._stat = None
+        # byte ranges written by this session after the tail
+        self._own = []
         super().__init__(history_file)
+        if self.durability != "immediate":
+            atexit.register(self.flush)
+
+    def load_history_entries(self):
+        if not os.path.exists(self.filename):
+            return CompactHistoryStrings()
+
+        f = open(self.filename, "rb")
+        self._indexed = self._index.load(f)
+        self._file_id = _file_id(f)
+        self._compaction_pending = \
+            self.dedup or len(self._index) > max(self.max_history_size, 10)
+        if not self._indexed:
+            # the sidecar index can't be written, e.g., read only directory
+            self._set_tail(f, os.fstat(f.fileno()).st_size)
+            f.close()
+            return super().load_history_entries()
+
+        self._set_tail(f, self._index.end)
+        return IndexedHistoryStrings(f, self._index)
+
+    def start_background_tasks(self):
+        if self._compaction_pending:
+            self._compaction_pending = False
+            threading.Thread(target=self.compact_history, daemon=True).start()
+
+    def compact_history(self):
+        """
+        Trim the history file to 90% of `max_history_size` entries. The kept entries are
+        copied to a temporary file which is then renamed over the history file.
+        """
+        try:
+            with locked(self.filename):
+                if self.dedup:
+                    self._dedup_history()
+                self._compact_history()
+        except OSError as e:
+            logger.warning("failed to compact history: %s", e)
+
+    def dedup_history(self):
+        """
+        Remove the entries of the history file which occur again later with the same mode.
+        Return the number of entries removed.
+        """
+        self.flush()
+        with locked(self.filename):
+            return self._dedup_history()
+
+    def _dedup_history(self):
+        if not os.path.exists(self.filename):
+            return 0
+        with open(self.filename, "rb") as f, open(self.filename, "rb") as g:
+            # the last occurrence of each entry, by the digest of its mode and text
+            last = {}
+            count = 0
+            for mode, _, offset, length in scan_entries(f, 0):
+                g.seek(offset)
+                last[entry_digest(mode, g.read(length))] = count
+                count += 1
+            if len(last) == count:
+                return 0
+            keep = array("Q", sorted(last.values()))
+            del last
+
+            file_id = _file_id(f)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.filename) or ".")
+            try:
+                with os.fdopen(fd, "wb") as out:
+                    start = 0
+                    j = 0
+                    for k, (_, _, offset, length) in enumerate(scan_entries(f, 0)):
+                        # an entry is copied with the header lines preceding it
+                        if k >= count or (j < len(keep) and keep[j] == k):
+                            g.seek(start)
+                            out.write(g.read(offset + length - start))
+                            j += 1
+                        start = offset + length
+                    g.seek(start)
+                    shutil.copyfileobj(g, out)
+                    out.flush()
+                    os.fsync(out.fileno())
+                shutil.copymode(self.filename, tmp)
+            except BaseException:
+                os.unlink(tmp)
+                raise
+
+        def remap(k):
+            # the position of the entry `k` in the new file
+            if k >= count:
+                return len(keep) + k - count
+            j = bisect_left(keep, k)
+            return j if j < len(keep) and keep[j] == k else None
+
+        self._replace_file(file_id, tmp, remap=remap)
+        self._reload_index()
+        return count - len(keep)
+
+    def _reload_index(self):
+        index = HistoryIndex(self.filename)
+        with open(self.filename, "rb") as f:
+            index.load(f)
+            self._file_id = _file_id(f)
+        self._index = index
+
+    def _replace_file(self, file_id, tmp, cut=None, remap=None):
+        if self._out is not None:
+            # a file can't be replaced while it is open on Windows
+            self._out.close()
+            self._out = None
+
+        if isinstance(self._loaded_strings, LazyHistoryStrings):
+            with self._loaded_strings.detached(file_id, cut, remap):
+                os.replace(tmp, self.filename)
+        else:
+            os.replace(tmp, self.filename)
+
+    def _compact_history(self):
+        with open(self.filename, "rb") as f:
+            index = HistoryIndex(self.filename)
+            index.load(f)
+            if len(index) <= max(self.max_history_size, 10):
+                return
+            keep = round(self.max_history_size * 0.9)
+            _, _, offset, length = index.record(len(index) - keep - 1)
+            cut = offset + length
+            file_id = _file_id(f)
+            tmp = self._copy_from(f, cut)
+
+        self._replace_file(file_id, tmp, cut)
+
+        index = index.rebased(cut, keep)
+        with open(self.filename, "rb") as f:
+            index._scan(f)
+            self._file_id = _file_id(f)
+        self._index = index
+        self._index.write()
+
+    def _copy_from(self, f, cut):
+        """
+        Copy the history file `f` from the offset `cut` to a temporary file next to it.
+        Return the name of the copy.
+        """
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.filename) or ".")
+        try:
+            with os.fdopen(fd, "wb") as g:
+                f.seek(cut)
+                # entries written without holding the lock, e.g., by older versions of
+                # radian, are picked up until the file stops growing
+                while True:
+                    shutil.copyfileobj(f, g)
+                    if f.tell() == os.fstat(f.fileno()).st_size:
+                        break
+                g.flush()
+                os.fsync(g.fileno())
+            shutil.copymode(self.filename, tmp)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        return tmp
 
     def load_history_strings(self):
         strings = []
         lines = []
         mode = [None]
-        breaks = []
 
         def add() -> None:
             if lines:
@@ -47,7 +702,7 @@ class ModalFileHistory(ModelHistory, FileHistory):
 
         if os.path.exists(self.filename):
             with open(self.filename, "rb") as f:
-                for i, line_bytes in enumerate(f):
+                for line_bytes in f:
                     line = line_bytes.decode("utf-8", errors="replace")
 
                     if line.startswith('# mode: '):
@@ -56,31 +711,230 @@ class ModalFileHistory(ModelHistory, FileHistory):
                         lines.append(line[1:])
                     else:
                         add()
-                        if lines:
-                            breaks.append(i)
                         lines = []
 
                 add()
 
-            if len(breaks) > max(self.max_history_size, 10):
-                # trim history if it is too big
-                with open(self.filename, "r+", encoding="utf-8") as f:
-                    backup = f.readlines()
-                    f.seek(0)
-                    f.truncate()
-                    trimed = backup[breaks[-round(self.max_history_size * 0.9)]+1:]
-                    f.writelines(trimed)
-
         # Reverse the order, because newest items have to go first.
         return reversed(strings)
 
     def store_string(self, string, mode):
-        # Save to file.
-        with open(self.filename, 'ab') as f:
-            def write(t):
-                f.write(t.encode('utf-8'))
-
-            write('\n# time: %s UTC' % datetime.datetime.utcnow().strftime("%Y-%m-%d %H:%M:%S"))
-            write('\n# mode: %s\n' % mode)
-            for line in string.split('\n'):
-                write('+%s\n' % line)
+        now = datetime.datetime.utcnow()
+        entry = format_entry(mode, string, float(calendar.timegm(now.utctimetuple())))
+
+        if self.durability == "immediate":
+            with self._write_lock:
+                self._write([entry])
+            return
+
+        with self._pending_lock:
+            self._pending.append(entry)
+        if self.durability == "batched":
+            if self._pending_event is None:
+                self._pending_event = threading.Event()
+                threading.Thread(target=self._write_behind, daemon=True).start()
+            self._pending_event.set()
+
+    def _write_behind(self):
+        while True:
+            self._pending_event.wait()
+            time.sleep(self.batch_delay)
+            self._pending_event.clear()
+            try:
+                self.flush()
+            except OSError as e:
+                logger.warning("failed to save history: %s", e)
+
+    def append_entries(self, entries, batch_size=1000):
+        """
+        Append `(mode, timestamp, string)` entries, e.g., imported from other histories,
+        to the history file. The entries are written in batches as they are read, they are
+        not added to the loaded history. Return the number of entries written.
+        """
+        self.flush()
+        count = 0
+        batch = []
+        for mode, timestamp, string in entries:
+            batch.append(format_entry(mode, string, timestamp))
+            if len(batch) == batch_size:
+                with self._write_lock:
+                    self._write(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            with self._write_lock:
+                self._write(batch)
+            count += len(batch)
+        return count
+
+    def flush(self):
+        with self._write_lock:
+            with self._pending_lock:
+                entries, self._pending = self._pending, []
+            if not entries:
+                return
+            try:
+                self._write(entries)
+            except BaseException:
+                with self._pending_lock:
+                    self._pending[:0] = entries
+                raise
+
+    def _write(self, entries):
+        with locked(self.filename):
+            f = self._open_for_append()
+            # other sessions may have written to the file since it was opened
+            start = f.seek(0, os.SEEK_END)
+            if self._indexed and (self._file_id != _file_id(f) or start != self._index.end):
+                # index entries written by other sessions first
+                with open(self.filename, 'rb') as g:
+                    if self._file_id != _file_id(g) or start < self._index.end:
+                        # the file was compacted by another session
+                        self._index = HistoryIndex(self.filename)
+                        self._index.load(g)
+                        self._file_id = _file_id(g)
+                    else:
+                        self._index.sync(g)
+
+            records = []
+            offset = start
+            for mode, timestamp, header_length, data in entries:
+                records.append((mode, timestamp, offset + header_length, len(data) - header_length))
+                offset += len(data)
+            data = b"".join(data for _, _, _, data in entries)
+            f.write(data)
+            f.flush()
+
+            if self.shared:
+                if _file_id(f) == self._tail_id and start == self._tail:
+                    self._tail = offset
+                    self._tail_marker = (self._tail_marker + data)[-256:]
+                else:
+                    self._own.append((_file_id(f), start, offset))
+
+            if self._indexed:
+                try:
+                    self._index.extend(records)
+                except OSError:
+                    self._indexed = False
+
+    def _open_for_append(self):
+        # the history file is kept open, unless it was replaced, e.g., by compaction
+        f = self._out
+        if f is not None:
+            try:
+                st = os.stat(self.filename)
+                if (st.st_dev, st.st_ino) == _file_id(f):
+                    return f
+            except OSError:
+                pass
+            f.close()
+        f = self._out = open(self.filename, 'ab')
+        return f
+
+    def _set_tail(self, f, end):
+        self._tail = end
+        self._tail_id = _file_id(f)
+        f.seek(max(0, end - 256))
+        self._tail_marker = f.read(end - max(0, end - 256))
+        self._stat = _stat_key(os.fstat(f.fileno()))
+
+    def refresh(self):
+        if not self.shared or not self._loaded:
+            return False
+        try:
+            if _stat_key(os.stat(self.filename)) == self._stat:
+                return False
+        except OSError:
+            return False
+
+        with locked(self.filename), open(self.filename, "rb") as f:
+            file_id = _file_id(f)
+            if file_id != self._tail_id:
+                self._relocate_tail(f)
+            records = list(scan_entries(f, self._tail))
+            entries = []
+            for mode, timestamp, offset, length in records:
+                if not any(i == file_id and s <= offset < e for i, s, e in self._own):
+                    f.seek(offset)
+                    entries.append((mode, decode_entry(f.read(length)), timestamp))
+            if records:
+                _, _, offset, length = records[-1]
+                self._set_tail(f, offset + length)
+                self._own = [r for r in self._own if r[2] > self._tail]
+            else:
+                self._stat = _stat_key(os.fstat(f.fileno()))
+
+        for mode, string, timestamp in entries:
+            self._add_entry(mode, string, timestamp)
+        return bool(entries)
+
+    def _relocate_tail(self, f):
+        # the file was replaced by compaction, which keeps the newest entries
+        data = f.read()
+        if self._tail_marker:
+            i = data.rfind(self._tail_marker)
+            tail = i + len(self._tail_marker) if i >= 0 else len(data)
+        else:
+            tail = 0
+        cut = self._tail - tail
+        file_id = _file_id(f)
+        self._own = [
+            (file_id, s - cut, e - cut) if i == self._tail_id else (i, s, e)
+            for i, s, e in self._own]
+        self._tail = tail
+        self._tail_id = file_id
+
+
+class ModalMappedHistory(ModalFileHistory):
+    """
+    A history file which is memory mapped instead of indexed. Loading only locates the
+    entries, they are parsed when navigation, auto suggestion or search reaches them.
+    """
+    def load_history_entries(self):
+        if not os.path.exists(self.filename):
+            return CompactHistoryStrings()
+
+        f = open(self.filename, "rb")
+        entries = MappedHistoryStrings(f)
+        self._compaction_pending = \
+            self.dedup or len(entries) > max(self.max_history_size, 10)
+        self._set_tail(f, entries.end)
+        return entries
+
+    def search_candidates(self, text):
+        # building a search index would parse every entry,
+        # a linear search only parses the entries it visits
+        return None
+
+    def _reload_index(self):
+        # no sidecar index is kept
+        with open(self.filename, "rb") as f:
+            self._file_id = _file_id(f)
+
+    def _compact_history(self):
+        with open(self.filename, "rb") as f:
+            ends = array("Q", (offset + length for _, _, offset, length in scan_entries(f, 0)))
+            if len(ends) <= max(self.max_history_size, 10):
+                return
+            keep = round(self.max_history_size * 0.9)
+            cut = ends[len(ends) - keep - 1]
+            del ends
+            file_id = _file_id(f)
+            tmp = self._copy_from(f, cut)
+
+        self._replace_file(file_id, tmp, cut)
+        with open(self.filename, "rb") as f:
+            self._file_id = _file_id(f)
+
+    def mode_positions(self, mode):
+        return None
+
+
+def _file_id(f):
+    st = os.fstat(f.fileno())
+    return (st.st_dev, st.st_ino)
+
+
+def _stat_key(st):
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
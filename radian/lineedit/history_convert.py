@@ -0,0 +1,167 @@
+"""
+Convert histories between radian's history file, plain `.Rhistory` files, JSON lines and
+the SQLite history database. The entries are streamed from the source and appended to the
+target, so that large archives are converted in constant memory.
+
+    python -m radian.lineedit.history_convert ~/.Rhistory ~/.radian_history
+"""
+import json
+import optparse
+import os
+import sqlite3
+import time
+
+from .history import ModalFileHistory
+from .history_index import scan_entries, decode_entry
+from .history_sqlite import connect, create_tables
+
+
+# R's `timestamp()` writes lines such as "##------ Mon Jan  1 00:00:00 2024 ------##"
+RHISTORY_TIME_PREFIX = "##------ "
+RHISTORY_TIME_SUFFIX = " ------##"
+
+
+def read_radian_history(filename, mode=None):
+    with open(filename, "rb") as f, open(filename, "rb") as g:
+        for entry_mode, timestamp, offset, length in scan_entries(f, 0):
+            if mode is None or entry_mode == mode:
+                g.seek(offset)
+                yield (entry_mode, timestamp, decode_entry(g.read(length)))
+
+
+def write_radian_history(filename, entries, mode=None):
+    history = ModalFileHistory(filename, 0)
+    return history.append_entries(
+        (m, t, s) for m, t, s in entries if mode is None or m == mode)
+
+
+def read_rhistory(filename, mode=None):
+    # every line is an entry, R doesn't record where a multiline command ends
+    mode = mode or "r"
+    timestamp = 0.0
+    with open(filename, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            line = line.rstrip("\r\n")
+            if line.startswith(RHISTORY_TIME_PREFIX) and line.endswith(RHISTORY_TIME_SUFFIX):
+                date = line[len(RHISTORY_TIME_PREFIX):-len(RHISTORY_TIME_SUFFIX)]
+                try:
+                    timestamp = time.mktime(time.strptime(" ".join(date.split())))
+                except (ValueError, OverflowError):
+                    pass
+            elif line.strip():
+                yield (mode, timestamp, line)
+
+
+def write_rhistory(filename, entries, mode=None):
+    # only the entries of the r mode are R code
+    mode = mode or "r"
+    count = 0
+    with open(filename, "a", encoding="utf-8") as f:
+        for entry_mode, _, string in entries:
+            if entry_mode == mode:
+                f.write(string + "\n")
+                count += 1
+    return count
+
+
+def read_jsonl(filename, mode=None):
+    with open(filename, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if mode is None or record.get("mode") == mode:
+                yield (record.get("mode"), record.get("time") or 0.0, record["text"])
+
+
+def write_jsonl(filename, entries, mode=None):
+    count = 0
+    with open(filename, "a", encoding="utf-8") as f:
+        for entry_mode, timestamp, string in entries:
+            if mode is None or entry_mode == mode:
+                record = {"time": timestamp or None, "mode": entry_mode, "text": string}
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                count += 1
+    return count
+
+
+def read_sqlite(filename, mode=None):
+    conn = sqlite3.connect(filename)
+    try:
+        if mode is None:
+            rows = conn.execute("SELECT mode, timestamp, text FROM history ORDER BY id")
+        else:
+            rows = conn.execute(
+                "SELECT mode, timestamp, text FROM history WHERE mode = ? ORDER BY id", (mode,))
+        for entry_mode, timestamp, string in rows:
+            yield (entry_mode, timestamp or 0.0, string)
+    finally:
+        conn.close()
+
+
+def write_sqlite(filename, entries, mode=None):
+    conn = connect(filename)
+    try:
+        create_tables(conn)
+        rows = (
+            (m, t or None, s) for m, t, s in entries if mode is None or m == mode)
+        with conn:
+            conn.execute("BEGIN")
+            cur = conn.executemany(
+                "INSERT INTO history (mode, timestamp, text) VALUES (?, ?, ?)", rows)
+        return cur.rowcount
+    finally:
+        conn.close()
+
+
+FORMATS = {
+    "radian": (read_radian_history, write_radian_history),
+    "rhistory": (read_rhistory, write_rhistory),
+    "jsonl": (read_jsonl, write_jsonl),
+    "sqlite": (read_sqlite, write_sqlite)
+}
+
+
+def guess_format(filename):
+    name = os.path.basename(filename).lower()
+    ext = os.path.splitext(name)[1]
+    if name == ".rhistory" or ext == ".rhistory":
+        return "rhistory"
+    elif ext in (".jsonl", ".json"):
+        return "jsonl"
+    elif ext in (".sqlite", ".db"):
+        return "sqlite"
+    return "radian"
+
+
+def convert(source, target, source_format=None, target_format=None, mode=None):
+    """
+    Append the entries of the history `source` to the history `target`. The formats are
+    guessed from the file names if they are not given. If `mode` is given, only the
+    entries of the mode are converted, it is the mode of the entries of a `.Rhistory` file.
+    Return the number of entries written.
+    """
+    read = FORMATS[source_format or guess_format(source)][0]
+    write = FORMATS[target_format or guess_format(target)][1]
+    return write(target, read(source, mode), mode)
+
+
+def main():
+    parser = optparse.OptionParser(
+        "usage: python -m radian.lineedit.history_convert [options] SOURCE TARGET")
+    choices = sorted(FORMATS)
+    parser.add_option("--from", dest="source_format", choices=choices,
+                      help="Format of SOURCE, one of {}".format(", ".join(choices)))
+    parser.add_option("--to", dest="target_format", choices=choices,
+                      help="Format of TARGET, one of {}".format(", ".join(choices)))
+    parser.add_option("--mode", dest="mode",
+                      help="Only convert the entries of this mode, e.g., r")
+    options, args = parser.parse_args()
+    if len(args) != 2:
+        parser.error("expected SOURCE and TARGET")
+    count = convert(args[0], args[1], options.source_format, options.target_format, options.mode)
+    print("{} entries written to {}".format(count, args[1]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,317 @@
+import calendar
+import hashlib
+import os
+import struct
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    # windows
+    import msvcrt
+    fcntl = None
+
+
+# The sidecar index of a history file is a header followed by fixed size records.
+# The header is the magic and the digest of the start of the history file, up to the end of
+# the first entry, so that the index of a file which was rewritten, e.g., trimmed in place by
+# an older version of radian, is not used.
+# Each record describes one entry of the text file:
+#   mode (utf-8, null padded), timestamp (UTC seconds, 0 if unknown),
+#   byte offset of the first `+` line, byte length of the `+` lines.
+INDEX_MAGIC = b"RADHIDX2"
+DIGEST_SIZE = 16
+HEADER_SIZE = len(INDEX_MAGIC) + DIGEST_SIZE
+RECORD = struct.Struct("<16sdQI")
+# the number of bytes at the start of the history file in the digest
+IDENTITY_SIZE = 4096
+
+# a mode name which doesn't fit in the record is read from the text file instead
+MODE_IN_TEXT = b"\xff"
+
+
+def index_filename(filename):
+    return filename + ".idx"
+
+
+def parse_time(line):
+    # "# time: %Y-%m-%d %H:%M:%S UTC"
+    try:
+        return float(calendar.timegm(time.strptime(line[8:27], "%Y-%m-%d %H:%M:%S")))
+    except ValueError:
+        return 0.0
+
+
+def pack_mode(mode):
+    if mode is None:
+        return b""
+    raw = mode.encode("utf-8")
+    if len(raw) > 16 or not raw:
+        return MODE_IN_TEXT
+    return raw
+
+
+def scan_entries(f, start):
+    """
+    Scan the text history from byte offset `start`, which should be at a line boundary.
+    Yield `(mode, timestamp, offset, length)` for every complete entry found.
+    """
+    f.seek(start)
+    pos = start
+    mode = None
+    timestamp = 0.0
+    offset = None
+    for line_bytes in f:
+        if line_bytes.startswith(b"+"):
+            if offset is None:
+                offset = pos
+        else:
+            if offset is not None:
+                yield (mode, timestamp, offset, pos - offset)
+                offset = None
+                timestamp = 0.0
+            if line_bytes.startswith(b"# mode: "):
+                mode = line_bytes[8:].decode("utf-8", errors="replace").strip()
+            elif line_bytes.startswith(b"# time: "):
+                timestamp = parse_time(line_bytes.decode("utf-8", errors="replace"))
+        pos += len(line_bytes)
+
+    if offset is not None and line_bytes.endswith(b"\n"):
+        yield (mode, timestamp, offset, pos - offset)
+
+
+def read_header(f, offset):
+    # the `#` lines preceding the entry at `offset`, up to 256 bytes
+    f.seek(max(0, offset - 256))
+    header = f.read(offset - max(0, offset - 256))
+    return header[header.rfind(b"\n+") + 1:]
+
+
+def read_mode(f, offset):
+    # look for the `# mode: ` line in the header preceding the entry
+    header = read_header(f, offset)
+    i = header.rfind(b"# mode: ")
+    if i < 0:
+        return None
+    return header[i + 8:].split(b"\n", 1)[0].decode("utf-8", errors="replace").strip()
+
+
+def read_time(f, offset):
+    header = read_header(f, offset)
+    i = header.rfind(b"# time: ")
+    if i < 0:
+        return 0.0
+    return parse_time(header[i:].split(b"\n", 1)[0].decode("utf-8", errors="replace"))
+
+
+def entry_digest(mode, data):
+    # identifies an entry by its mode and the bytes of its `+` lines
+    h = hashlib.blake2b((mode or "").encode("utf-8") + b"\n", digest_size=16)
+    h.update(data)
+    return h.digest()
+
+
+def file_digest(f, end):
+    # the digest of the start of the history file `f`, up to `end`
+    f.seek(0)
+    return hashlib.blake2b(f.read(min(end, IDENTITY_SIZE)), digest_size=DIGEST_SIZE).digest()
+
+
+def decode_entry(data):
+    return "\n".join(line[1:] for line in data.decode("utf-8", errors="replace").split("\n")[:-1])
+
+
+class HistoryIndex():
+    """
+    The in-memory copy of the sidecar index of a history file.
+    Records are kept packed and only unpacked when they are accessed.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.index_filename = index_filename(filename)
+        self._records = bytearray()
+        self._mode_names = {b"": None}
+
+    def __len__(self):
+        return len(self._records) // RECORD.size
+
+    def record(self, i):
+        return RECORD.unpack_from(self._records, i * RECORD.size)
+
+    def mode(self, i):
+        return self.decode_mode(self.record(i)[0].rstrip(b"\0"))
+
+    def raw_modes(self, start, stop):
+        """
+        Get the mode fields of the records from `start` to `stop`, without null padding.
+        """
+        for record in RECORD.iter_unpack(
+                memoryview(self._records)[start * RECORD.size:stop * RECORD.size]):
+            yield record[0].rstrip(b"\0")
+
+    def decode_mode(self, raw):
+        try:
+            return self._mode_names[raw]
+        except KeyError:
+            pass
+        name = self._mode_names[raw] = raw.decode("utf-8", errors="replace")
+        return name
+
+    @property
+    def end(self):
+        if not len(self):
+            return 0
+        _, _, offset, length = self.record(len(self) - 1)
+        return offset + length
+
+    def _identity(self, f):
+        if not len(self):
+            return bytes(DIGEST_SIZE)
+        _, _, offset, length = self.record(0)
+        return file_digest(f, offset + length)
+
+    def _valid(self, f, size, digest):
+        n = len(self)
+        if not n:
+            return True
+        _, _, offset, length = self.record(n - 1)
+        if offset + length > size:
+            return False
+        if self._identity(f) != digest:
+            return False
+        f.seek(offset)
+        if f.read(1) != b"+":
+            return False
+        f.seek(offset + length - 1)
+        return f.read(1) == b"\n"
+
+    def load(self, f):
+        """
+        Load the sidecar index of the history file `f` (opened in binary mode),
+        rebuilding it if it is missing or stale. Return whether the index could be written.
+        """
+        size = os.fstat(f.fileno()).st_size
+        try:
+            with open(self.index_filename, "rb") as idx:
+                data = idx.read()
+        except OSError:
+            data = b""
+
+        rewrite = True
+        self._records = bytearray()
+        if data.startswith(INDEX_MAGIC) and len(data) >= HEADER_SIZE:
+            n = (len(data) - HEADER_SIZE) // RECORD.size
+            self._records = bytearray(data[HEADER_SIZE:HEADER_SIZE + n * RECORD.size])
+            if self._valid(f, size, data[len(INDEX_MAGIC):HEADER_SIZE]):
+                rewrite = len(data) != HEADER_SIZE + len(self._records)
+            else:
+                self._records = bytearray()
+
+        new = self._scan(f)
+        try:
+            if rewrite:
+                self.write()
+            elif new:
+                self._append_records(new)
+        except OSError:
+            return False
+        return True
+
+    def _append_records(self, records):
+        if len(self) == len(records) // RECORD.size:
+            # the digest of the file is written with the first record
+            self.write()
+        else:
+            with open(self.index_filename, "ab") as idx:
+                idx.write(records)
+
+    def _scan(self, f):
+        new = bytearray()
+        for mode, timestamp, offset, length in scan_entries(f, self.end):
+            new += RECORD.pack(pack_mode(mode), timestamp, offset, length)
+        self._records += new
+        return new
+
+    def sync(self, f):
+        """
+        Index the entries which were written after the last indexed entry,
+        e.g., by other sessions or an older version of radian.
+        """
+        new = self._scan(f)
+        if new:
+            self._append_records(new)
+
+    def append(self, mode, timestamp, offset, length):
+        self.extend([(mode, timestamp, offset, length)])
+
+    def extend(self, entries):
+        records = b"".join(
+            RECORD.pack(pack_mode(mode), timestamp, offset, length)
+            for mode, timestamp, offset, length in entries)
+        if records:
+            self._records += records
+            self._append_records(records)
+
+    def write(self):
+        # write a new file and rename it, so that readers never see a partial index
+        with open(self.filename, "rb") as f:
+            digest = self._identity(f)
+        tmp = self.index_filename + ".tmp"
+        with open(tmp, "wb") as idx:
+            idx.write(INDEX_MAGIC)
+            idx.write(digest)
+            idx.write(self._records)
+        os.replace(tmp, self.index_filename)
+
+    def rebased(self, cut, keep):
+        """
+        Return a new index with the last `keep` records, of which the offsets are shifted
+        as the first `cut` bytes were removed from the history file.
+        """
+        index = HistoryIndex(self.filename)
+        for i in range(len(self) - keep, len(self)):
+            mode, timestamp, offset, length = self.record(i)
+            index._records += RECORD.pack(mode, timestamp, offset - cut, length)
+        return index
+
+
+@contextmanager
+def locked(filename):
+    """
+    Hold the advisory lock of the history file `filename`.
+    A separate lock file is used, as the history file itself may be replaced. If the lock
+    file can't be created, e.g., in a read only directory, where the history file can't be
+    replaced either, the history file itself is locked.
+    """
+    try:
+        f = open(filename + ".lock", "a")
+    except OSError:
+        try:
+            f = open(filename, "rb")
+        except OSError:
+            f = None
+    if f is None:
+        # nothing to lock, the history file doesn't exist and can't be created
+        yield
+        return
+
+    with f:
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            f.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
@@ -0,0 +1,157 @@
+import heapq
+import threading
+from array import array
+from collections.abc import Sequence
+
+from prompt_toolkit.history import History
+
+from .history import ModelHistory
+from .history_store import CompactHistoryStrings
+
+
+class MergedHistoryStrings(Sequence):
+    """
+    The `(mode, string)` entries of several histories, oldest first, interleaved by time.
+    The histories are merged from their newest entries, only as far as the entries are
+    accessed, so an old entry of one history doesn't require reading the others in full.
+    Entries added in this session are kept in memory.
+    """
+    def __init__(self, sources):
+        self._sources = sources
+        self._count = sum(len(s) for s in sources)
+        # the source and the position in the source of the merged entries, newest first
+        self._merged_sources = array("B")
+        self._merged_positions = array("Q")
+        # the next entry of each source to be merged, keyed by its time
+        self._heap = [
+            (-s.timestamp(len(s) - 1), j, len(s) - 1) for j, s in enumerate(sources) if len(s)]
+        heapq.heapify(self._heap)
+        self._appended = CompactHistoryStrings()
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return self._count + len(self._appended)
+
+    def _merge(self, n):
+        with self._lock:
+            heap = self._heap
+            while len(self._merged_sources) < n:
+                _, j, k = heapq.heappop(heap)
+                self._merged_sources.append(j)
+                self._merged_positions.append(k)
+                if k > 0:
+                    heapq.heappush(heap, (-self._sources[j].timestamp(k - 1), j, k - 1))
+
+    def _locate(self, k):
+        rank = self._count - 1 - k
+        if rank >= len(self._merged_sources):
+            self._merge(rank + 1)
+        return self._sources[self._merged_sources[rank]], self._merged_positions[rank]
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[j] for j in range(*k.indices(len(self)))]
+        if k < 0:
+            k += len(self)
+        if k >= self._count:
+            return self._appended[k - self._count]
+        if k < 0:
+            raise IndexError("history index out of range")
+        source, position = self._locate(k)
+        return source[position]
+
+    def mode(self, k):
+        if k >= self._count:
+            return self._appended.mode(k - self._count)
+        source, position = self._locate(k)
+        return source.mode(position)
+
+    def modes(self, start=0):
+        for k in range(start, len(self)):
+            yield self.mode(k)
+
+    def timestamp(self, k):
+        if k >= self._count:
+            return self._appended.timestamp(k - self._count)
+        source, position = self._locate(k)
+        return source.timestamp(position)
+
+    def timestamps(self, start=0):
+        for k in range(start, len(self)):
+            yield self.timestamp(k)
+
+    def append(self, entry, timestamp=0.0):
+        self._appended.append(entry, timestamp)
+
+
+class MergedHistory(ModelHistory, History):
+    """
+    The entries of a local history and the global history, interleaved by time.
+    New entries are written to the local history.
+    """
+    def __init__(self, local_history, global_history):
+        self.local_history = local_history
+        self.global_history = global_history
+        # the number of entries of each history which are in the merged entries
+        self._seen = [0, 0]
+        super().__init__()
+
+    @property
+    def durability(self):
+        # new entries are written to the local history
+        return self.local_history.durability
+
+    @property
+    def _histories(self):
+        # the local history first, so that its entries are newer at the same time
+        return (self.local_history, self.global_history)
+
+    def load_history_entries(self):
+        for history in self._histories:
+            history.load_if_not_yet_loaded()
+        sources = [history._loaded_strings for history in self._histories]
+        self._seen = [len(s) for s in sources]
+        return MergedHistoryStrings(sources)
+
+    def load_history_strings(self):
+        self.load_if_not_yet_loaded()
+        for _, string in reversed(self._loaded_strings):
+            yield string
+
+    def store_string(self, string, mode):
+        self.local_history.append_string(string, mode)
+        self._seen[0] += 1
+
+    def mode_positions(self, mode):
+        # an index of the modes would merge the whole global history, navigation only
+        # merges the entries it visits
+        return None
+
+    def start_background_tasks(self):
+        for history in self._histories:
+            history.start_background_tasks()
+
+    def flush(self):
+        for history in self._histories:
+            history.flush()
+
+    def command_finished(self):
+        self.local_history.command_finished()
+
+    def dedup_history(self):
+        return sum(history.dedup_history() for history in self._histories)
+
+    def refresh(self):
+        if not self._loaded:
+            return False
+        new = False
+        for j, history in enumerate(self._histories):
+            if not history.refresh():
+                continue
+            strings = history._loaded_strings
+            for k in range(self._seen[j], len(strings)):
+                mode, string = strings[k]
+                self._add_entry(mode, string, strings.timestamp(k))
+            self._seen[j] = len(strings)
+            new = True
+        return new
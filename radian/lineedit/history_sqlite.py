@@ -0,0 +1,365 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections.abc import Sequence
+
+from prompt_toolkit.history import History
+
+from .history import ModelHistory
+from .history_index import scan_entries, decode_entry
+
+logger = logging.getLogger(__name__)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    mode TEXT,
+    timestamp REAL,
+    cwd TEXT,
+    duration REAL,
+    text TEXT NOT NULL
+);
+"""
+
+# an external content table, so that the text is not stored twice
+FTS_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE history_fts USING fts5(
+        text, content='history', content_rowid='id', tokenize='trigram')
+    """,
+    """
+    CREATE TRIGGER history_insert AFTER INSERT ON history BEGIN
+        INSERT INTO history_fts(rowid, text) VALUES (new.id, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER history_delete AFTER DELETE ON history BEGIN
+        INSERT INTO history_fts(history_fts, rowid, text) VALUES ('delete', old.id, old.text);
+    END
+    """,
+    "INSERT INTO history_fts(history_fts) VALUES ('rebuild')"
+]
+
+
+def connect(filename, check_same_thread=True):
+    conn = sqlite3.connect(
+        filename, timeout=10, isolation_level=None, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def create_tables(conn):
+    """
+    Create the history table and its full text index. Return whether the full text index
+    is available, it requires the trigram tokenizer of SQLite 3.34.
+    """
+    conn.execute(SCHEMA)
+    if conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'history_fts'").fetchone():
+        return True
+    try:
+        with conn:
+            conn.execute("BEGIN")
+            for statement in FTS_SCHEMA:
+                conn.execute(statement)
+    except sqlite3.OperationalError as e:
+        logger.debug("full text search is not available: %s", e)
+        return False
+    return True
+
+
+def import_text_history(conn, filename):
+    """
+    Import the entries of a text history file. The entries are streamed into the database.
+    """
+    with open(filename, "rb") as f, open(filename, "rb") as g:
+        def rows():
+            for mode, timestamp, offset, length in scan_entries(f, 0):
+                g.seek(offset)
+                yield (mode, timestamp or None, decode_entry(g.read(length)))
+
+        with conn:
+            conn.execute("BEGIN")
+            conn.executemany("INSERT INTO history (mode, timestamp, text) VALUES (?, ?, ?)", rows())
+
+
+class SQLiteHistoryStrings(Sequence):
+    """
+    The `(mode, string)` entries of the history database, oldest first.
+    Entries are read from the database when they are accessed, the connection is used
+    with `lock` held, as the entries are also read by the completion thread.
+    """
+    def __init__(self, conn, ids, lock):
+        self._conn = conn
+        self._ids = ids
+        self._positions = None
+        self._strings = {}
+        # the timestamps of the entries which were deleted from the database
+        self._times = {}
+        self._lock = lock
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[j] for j in range(*k.indices(len(self)))]
+        if k < 0:
+            k += len(self)
+        if k < 0 or k >= len(self._ids):
+            raise IndexError("history index out of range")
+        try:
+            return self._strings[k]
+        except KeyError:
+            pass
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT mode, text FROM history WHERE id = ?", (self._ids[k],)).fetchone()
+            entry = self._strings[k] = (row[0], row[1])
+        return entry
+
+    def mode(self, k):
+        return self[k][0]
+
+    def modes(self, start=0):
+        ids = self._ids[start:]
+        if not ids:
+            return []
+        with self._lock:
+            modes = dict(self._conn.execute(
+                "SELECT id, mode FROM history WHERE id >= ?", (min(ids),)))
+        # entries which are deleted or not yet stored are in memory
+        return [
+            self._strings[k][0] if k in self._strings else modes.get(rowid)
+            for k, rowid in enumerate(ids, start)]
+
+    def timestamp(self, k):
+        try:
+            return self._times[k]
+        except KeyError:
+            pass
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT timestamp FROM history WHERE id = ?", (self._ids[k],)).fetchone()
+        return row[0] or 0.0 if row else 0.0
+
+    def timestamps(self, start=0):
+        ids = self._ids[start:]
+        if not ids:
+            return []
+        with self._lock:
+            times = dict(self._conn.execute(
+                "SELECT id, timestamp FROM history WHERE id >= ?", (min(ids),)))
+        return [
+            times.get(rowid) or self._times.get(k, 0.0)
+            for k, rowid in enumerate(ids, start)]
+
+    def set_last_id(self, rowid):
+        self._ids[-1] = rowid
+        if self._positions is not None:
+            self._positions[rowid] = len(self._ids) - 1
+
+    def add(self, rowid, entry):
+        self._strings[len(self._ids)] = entry
+        self._ids.append(rowid)
+        if self._positions is not None:
+            self._positions[rowid] = len(self._ids) - 1
+
+    def positions(self, rowids):
+        """
+        Get the sorted positions of the entries with the given ids.
+        """
+        if self._positions is None:
+            # entries of other sessions may be added out of order
+            self._positions = {rowid: k for k, rowid in enumerate(self._ids)}
+        positions = self._positions
+        return sorted(positions[rowid] for rowid in rowids if rowid in positions)
+
+    def kept_positions(self):
+        """
+        Get the sorted positions of the entries which were deleted from the database.
+        """
+        with self._lock:
+            return sorted(self._times)
+
+    def keep_entries(self, conn, rowids):
+        """
+        Keep the entries with the given ids in memory before they are deleted.
+        """
+        with self._lock:
+            for k, rowid in enumerate(self._ids):
+                if rowid in rowids:
+                    row = conn.execute(
+                        "SELECT mode, text, timestamp FROM history WHERE id = ?",
+                        (rowid,)).fetchone()
+                    if row:
+                        self._strings[k] = (row[0], row[1])
+                        self._times[k] = row[2] or 0.0
+
+
+class ModalSQLiteHistory(ModelHistory, History):
+    """
+    The history stored in a SQLite database with a full text index for search.
+    If the database doesn't exist, the entries of `text_history_file` are imported.
+    If `dedup` is true, only the most recent occurrence of each entry is kept when the
+    database is compacted.
+    """
+    def __init__(
+            self, filename, max_history_size, text_history_file=None, shared=False,
+            dedup=False):
+        self.filename = filename
+        self.max_history_size = max_history_size
+        self.text_history_file = text_history_file
+        self.shared = shared
+        self.dedup = dedup
+        self._conn = None
+        self._fts = False
+        self._data_version = None
+        # the last id read from the database and the ids written since then
+        self._seen_id = 0
+        self._own_ids = set()
+        self._last_command = None
+        self._compaction_pending = False
+        # the connection is shared with the completion thread
+        self._lock = threading.RLock()
+        super().__init__()
+
+    def load_history_entries(self):
+        new = not os.path.exists(self.filename)
+        conn = self._conn = connect(self.filename, check_same_thread=False)
+        self._fts = create_tables(conn)
+        if new and self.text_history_file and os.path.exists(self.text_history_file):
+            import_text_history(conn, self.text_history_file)
+        ids = array("Q", (row[0] for row in conn.execute("SELECT id FROM history ORDER BY id")))
+        self._data_version = self._get_data_version()
+        self._seen_id = ids[-1] if ids else 0
+        self._compaction_pending = self.dedup or len(ids) > max(self.max_history_size, 10)
+        return SQLiteHistoryStrings(conn, ids, self._lock)
+
+    def load_history_strings(self):
+        self.load_if_not_yet_loaded()
+        for _, string in reversed(self._loaded_strings):
+            yield string
+
+    def store_string(self, string, mode):
+        with self._lock:
+            cur = self._conn.execute(
+                "INSERT INTO history (mode, timestamp, cwd, text) VALUES (?, ?, ?, ?)",
+                (mode, time.time(), os.getcwd(), string))
+            self._loaded_strings.set_last_id(cur.lastrowid)
+        if self.shared:
+            self._own_ids.add(cur.lastrowid)
+        self._last_command = (cur.lastrowid, time.perf_counter())
+
+    def command_finished(self):
+        if self._last_command is None:
+            return
+        rowid, start = self._last_command
+        self._last_command = None
+        with self._lock:
+            self._conn.execute(
+                "UPDATE history SET duration = ? WHERE id = ?",
+                (time.perf_counter() - start, rowid))
+
+    def search_candidates(self, text):
+        if not self._fts:
+            return super().search_candidates(text)
+        if len(text) < 3:
+            return None
+        self.load_if_not_yet_loaded()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT rowid FROM history_fts WHERE history_fts MATCH ? ORDER BY rowid",
+                ('"' + text.replace('"', '""') + '"',)).fetchall()
+        positions = self._loaded_strings.positions(row[0] for row in rows)
+        # the entries deleted by compaction are only kept in memory
+        kept = self._loaded_strings.kept_positions()
+        return sorted(set(positions).union(kept)) if kept else positions
+
+    def _get_data_version(self):
+        # changed when the database is modified by other connections
+        with self._lock:
+            return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def refresh(self):
+        if not self.shared or not self._loaded:
+            return False
+        data_version = self._get_data_version()
+        if data_version == self._data_version:
+            return False
+        self._data_version = data_version
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, mode, text FROM history WHERE id > ? ORDER BY id",
+                (self._seen_id,)).fetchall()
+        new = False
+        for rowid, mode, text in rows:
+            if rowid not in self._own_ids:
+                self._add_entry(mode, text, rowid)
+                new = True
+        if rows:
+            self._seen_id = rows[-1][0]
+            self._own_ids = {i for i in self._own_ids if i > self._seen_id}
+        return new
+
+    def _add_entry(self, mode, string, rowid=0):
+        # the id of a new entry is set once it is stored
+        self._loaded_strings.add(rowid, (mode, string))
+        if self._search_index is not None:
+            self._search_index.add(string)
+
+    def start_background_tasks(self):
+        if self._compaction_pending:
+            self._compaction_pending = False
+            threading.Thread(target=self.compact_history, daemon=True).start()
+
+    def _keep_entries(self, conn, rowids):
+        if self._loaded:
+            self._loaded_strings.keep_entries(conn, rowids)
+
+    def compact_history(self):
+        """
+        Delete the oldest entries, keeping 90% of `max_history_size` entries.
+        """
+        try:
+            conn = connect(self.filename)
+            try:
+                if self.dedup:
+                    self._dedup_history(conn)
+                keep = round(self.max_history_size * 0.9)
+                row = conn.execute(
+                    "SELECT id FROM history ORDER BY id DESC LIMIT 1 OFFSET ?", (keep,)).fetchone()
+                if row is None:
+                    return
+                self._keep_entries(conn, range(row[0] + 1))
+                with conn:
+                    conn.execute("BEGIN")
+                    conn.execute("DELETE FROM history WHERE id <= ?", (row[0],))
+            finally:
+                conn.close()
+        except sqlite3.Error as e:
+            logger.warning("failed to compact history: %s", e)
+
+    def dedup_history(self):
+        self.load_if_not_yet_loaded()
+        with self._lock:
+            return self._dedup_history(self._conn)
+
+    def _dedup_history(self, conn):
+        # the entries are kept before the write transaction, as the lock of the history
+        # is held by `store_string` while it waits for the write lock of the database
+        rowids = {row[0] for row in conn.execute(
+            "SELECT id FROM history WHERE id NOT IN "
+            "(SELECT MAX(id) FROM history GROUP BY mode, text)")}
+        if not rowids:
+            return 0
+        self._keep_entries(conn, rowids)
+        with conn:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("DELETE FROM history WHERE id = ?", ((i,) for i in rowids))
+        return len(rowids)
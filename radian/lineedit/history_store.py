@@ -0,0 +1,62 @@
+from array import array
+from collections.abc import Sequence
+
+
+class CompactHistoryStrings(Sequence):
+    """
+    `(mode, string)` entries, oldest first, kept without a python object per entry.
+    Modes are interned to small integers and the strings are stored in a single
+    UTF-8 buffer, the entries are created when they are accessed.
+    The timestamps of the entries are kept alongside, 0 if unknown.
+    """
+    def __init__(self, entries=()):
+        self._mode_names = []
+        self._mode_codes = {}
+        self._modes = array("B")
+        self._text = bytearray()
+        self._offsets = array("Q", [0])
+        self._times = array("d")
+        for entry in entries:
+            self.append(entry)
+
+    def __len__(self):
+        return len(self._modes)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[j] for j in range(*k.indices(len(self)))]
+        if k < 0:
+            k += len(self)
+        if k < 0 or k >= len(self):
+            raise IndexError("history index out of range")
+        offsets = self._offsets
+        string = self._text[offsets[k]:offsets[k + 1]].decode("utf-8", "surrogatepass")
+        return (self._mode_names[self._modes[k]], string)
+
+    def mode(self, k):
+        return self._mode_names[self._modes[k]]
+
+    def modes(self, start=0):
+        names = self._mode_names
+        for code in self._modes[start:]:
+            yield names[code]
+
+    def timestamp(self, k):
+        return self._times[k]
+
+    def timestamps(self, start=0):
+        return self._times[start:]
+
+    def append(self, entry, timestamp=0.0):
+        mode, string = entry
+        try:
+            code = self._mode_codes[mode]
+        except KeyError:
+            code = self._mode_codes[mode] = len(self._mode_names)
+            self._mode_names.append(mode)
+            if code == 256:
+                self._modes = array("H", self._modes)
+        self._text += string.encode("utf-8", "surrogatepass")
+        self._offsets.append(len(self._text))
+        self._modes.append(code)
+        self._times.append(timestamp)
@@ -0,0 +1,125 @@
+from array import array
+from bisect import bisect_left
+
+
+class TrigramIndex():
+    """
+    An inverted index from the (case folded) trigrams of the history entries
+    to the positions of the entries which contain them.
+    """
+    def __init__(self):
+        self._postings = {}
+        self._count = 0
+        self._last_query = None
+        self._last_candidates = None
+
+    def __len__(self):
+        return self._count
+
+    def add(self, text):
+        position = self._count
+        self._count += 1
+        text = text.casefold()
+        postings = self._postings
+        for trigram in {text[i:i + 3] for i in range(len(text) - 2)}:
+            try:
+                postings[trigram].append(position)
+            except KeyError:
+                postings[trigram] = array("L", [position])
+        self._last_query = None
+
+    def candidates(self, query):
+        """
+        Get the sorted positions of the entries which may contain `query`.
+        Return `None` if the query is too short to be looked up.
+        """
+        query = query.casefold()
+        if len(query) < 3:
+            return None
+        if query == self._last_query:
+            return self._last_candidates
+
+        postings = []
+        for trigram in {query[i:i + 3] for i in range(len(query) - 2)}:
+            if trigram not in self._postings:
+                postings = []
+                break
+            postings.append(self._postings[trigram])
+
+        if postings:
+            postings.sort(key=len)
+            candidates = list(postings[0])
+            for p in postings[1:]:
+                candidates = [c for c in candidates if _contains(p, c)]
+                if not candidates:
+                    break
+        else:
+            candidates = []
+
+        self._last_query = query
+        self._last_candidates = candidates
+        return candidates
+
+
+class ModeIndex():
+    """
+    The positions of the history entries of each mode.
+    """
+    def __init__(self):
+        self._positions = {}
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, mode):
+        self.extend([mode])
+
+    def extend(self, modes):
+        positions = self._positions
+        count = self._count
+        for mode in modes:
+            try:
+                positions[mode].append(count)
+            except KeyError:
+                positions[mode] = array("L", [count])
+            count += 1
+        self._count = count
+
+    def positions(self, mode):
+        return self._positions.get(mode, array("L"))
+
+
+class TimeIndex():
+    """
+    The timestamps of the history entries by position, with a sorted copy for binary
+    search. An entry which is older than an entry before it, e.g., written by a session
+    with a different clock, or of which the time is unknown, is placed at the time of the
+    newest entry before it.
+    """
+    def __init__(self):
+        self._times = array("d")
+        self._sorted = array("d")
+
+    def __len__(self):
+        return len(self._times)
+
+    def add(self, timestamp):
+        self._times.append(timestamp)
+        self._sorted.append(max(timestamp, self._sorted[-1]) if self._sorted else timestamp)
+
+    def timestamp(self, position):
+        return self._times[position]
+
+    def range(self, start=None, end=None):
+        """
+        Get the range of positions of the entries from time `start` to `end` (excluded).
+        """
+        lo = 0 if start is None else bisect_left(self._sorted, start)
+        hi = len(self._sorted) if end is None else bisect_left(self._sorted, end, lo)
+        return range(lo, hi)
+
+
+def _contains(sorted_array, value):
+    i = bisect_left(sorted_array, value)
+    return i < len(sorted_array) and sorted_array[i] == value
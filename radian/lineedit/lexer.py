@@ -0,0 +1,299 @@
+import threading
+from bisect import bisect_left
+
+from prompt_toolkit.lexers import Lexer
+from prompt_toolkit.styles.pygments import pygments_token_to_classname
+
+from pygments.token import Error, Whitespace, _TokenType
+
+
+class TokenStyles(dict):
+    """
+    The prompt_toolkit style strings of pygments tokens.
+    """
+    def __missing__(self, token):
+        style = self[token] = "class:" + pygments_token_to_classname(token)
+        return style
+
+
+token_styles = TokenStyles()
+
+
+def lex_with_states(lexer, text, stack=("root",)):
+    """
+    Lex `text` with the pygments `RegexLexer` `lexer`, starting with the state `stack`, as
+    `lexer.get_tokens_unprocessed` does. In addition to the `(pos, token, value)` tokens,
+    `(pos, None, stack)` is yielded at every line start which is also a token boundary.
+    The text is lexed within `lexer.lexing(text)` if the lexer has it.
+    """
+    lexing = getattr(lexer, "lexing", None)
+    if lexing is not None:
+        with lexing(text):
+            yield from _lex_with_states(lexer, text, stack)
+    else:
+        yield from _lex_with_states(lexer, text, stack)
+
+
+def _lex_with_states(lexer, text, stack):
+    pos = 0
+    tokendefs = lexer._tokens
+    statestack = list(stack)
+    statetokens = tokendefs[statestack[-1]]
+    while True:
+        for rexmatch, action, new_state in statetokens:
+            m = rexmatch(text, pos)
+            if m:
+                if action is not None:
+                    if type(action) is _TokenType:
+                        yield pos, action, m.group()
+                    else:
+                        yield from action(lexer, m)
+                pos = m.end()
+                if new_state is not None:
+                    if isinstance(new_state, tuple):
+                        for state in new_state:
+                            if state == "#pop":
+                                if len(statestack) > 1:
+                                    statestack.pop()
+                            elif state == "#push":
+                                statestack.append(statestack[-1])
+                            else:
+                                statestack.append(state)
+                    elif isinstance(new_state, int):
+                        if abs(new_state) >= len(statestack):
+                            del statestack[1:]
+                        else:
+                            del statestack[new_state:]
+                    elif new_state == "#push":
+                        statestack.append(statestack[-1])
+                    statetokens = tokendefs[statestack[-1]]
+                if pos and text[pos - 1] == "\n":
+                    yield pos, None, tuple(statestack)
+                break
+        else:
+            if pos >= len(text):
+                break
+            if text[pos] == "\n":
+                # at EOL, reset state to "root"
+                statestack = ["root"]
+                statetokens = tokendefs["root"]
+                yield pos, Whitespace, "\n"
+                pos += 1
+                yield pos, None, ("root",)
+                continue
+            yield pos, Error, text[pos]
+            pos += 1
+
+
+# the number of lines lexed after a line being displayed
+LEX_AHEAD = 100
+
+
+def split_lines(tokens):
+    """
+    The fragments of each line of the `(pos, token, value)` tokens.
+    """
+    fragments = [[]]
+    for _, token, value in tokens:
+        if token is None:
+            continue
+        style = token_styles[token]
+        parts = value.split("\n")
+        for part in parts[:-1]:
+            if part:
+                fragments[-1].append((style, part))
+            fragments.append([])
+        if parts[-1]:
+            fragments[-1].append((style, parts[-1]))
+    return fragments
+
+
+class IncrementalLexer(Lexer):
+    """
+    Highlight a document with a pygments `RegexLexer`. The lines are lexed as they are
+    displayed, up to `LEX_AHEAD` lines after them, and the tokens of each line and the lexer
+    state at the start of each line are kept. A new document is lexed from the line before
+    the first changed line and the blank lines before it, or from an earlier line with a
+    token which may change with the text after it, and the tokens of the last document are
+    reused once the state at the start of a line after the change is the same as before. A
+    line more than `max_lines_backwards` lines after the lexed lines is lexed with the lines
+    around it only, from the line given by `syntax_sync`, e.g., when the end of a long
+    document is displayed.
+    """
+    def __init__(self, pygments_lexer_cls, syntax_sync=None, max_lines_backwards=1000):
+        self.pygments_lexer = pygments_lexer_cls(stripnl=False, stripall=False, ensurenl=False)
+        self.syntax_sync = syntax_sync
+        self.max_lines_backwards = max_lines_backwards
+        self._lines = []
+        # the lexer state at the start of each lexed line and of the line being lexed,
+        # `None` if a token spans the line break
+        self._states = []
+        self._fragments = []
+        # the lines with a token which may change with the text after it: where no rule of the
+        # lexer matched, e.g., a string which is not closed, or a token for which
+        # `pygments_lexer.lookahead(token, value)` is true
+        self._lookaheads = []
+        # the tokens of the rest of the document, `None` once it is lexed, and the fragments
+        # of the line being lexed
+        self._tokens = None
+        self._current = []
+        # the lexed lines of the last document, the lines from `converge` are its lines
+        # shifted by `delta`
+        self._last = None
+        self._converge = 0
+        self._delta = 0
+        # the lines around the displayed line which is far after the lexed lines
+        self._window = None
+        self._lock = threading.RLock()
+
+    def lex_document(self, document):
+        lines = document.lines
+        self.update(lines)
+
+        def get_line(i):
+            with self._lock:
+                self.update(lines)
+                if i >= len(self._fragments) and self._tokens is not None:
+                    if self.syntax_sync is not None and \
+                            i - len(self._fragments) > self.max_lines_backwards:
+                        return self._window_line(document, i)
+                    self._lex(i + LEX_AHEAD)
+                try:
+                    return self._fragments[i]
+                except IndexError:
+                    return []
+
+        return get_line
+
+    def update(self, lines):
+        """
+        Switch to the `lines` of a new document.
+        """
+        with self._lock:
+            if lines is not self._lines:
+                if lines != self._lines:
+                    self._update(lines)
+                self._lines = lines
+
+    def _update(self, lines):
+        old_lines = self._lines
+        n = len(lines)
+        m = len(old_lines)
+        limit = min(n, m)
+        p = 0
+        while p < limit and lines[p] == old_lines[p]:
+            p += 1
+        s = 0
+        while s < limit - p and lines[n - 1 - s] == old_lines[m - 1 - s]:
+            s += 1
+
+        # restart at a line before the change, tokens may look ahead past the line break and
+        # the blank lines before the change
+        c = min(max(p - 1, 0), len(self._fragments))
+        while c > 0 and not lines[c].strip():
+            c -= 1
+        if self._lookaheads and self._lookaheads[0] < c:
+            c = self._lookaheads[0]
+        while c > 0 and self._states[c] is None:
+            c -= 1
+        stack = self._states[c] if old_lines else ("root",)
+        self._last = (self._states, self._fragments, self._lookaheads, self._tokens is None)
+        self._states = self._states[:c]
+        self._fragments = self._fragments[:c]
+        self._lookaheads = self._lookaheads[:bisect_left(self._lookaheads, c)]
+        self._converge = n - s
+        self._delta = m - n
+        self._lines = lines
+        self._restart(c, stack)
+
+    def _restart(self, line, stack):
+        self._states.append(stack)
+        self._tokens = lex_with_states(
+            self.pygments_lexer, "\n".join(self._lines[line:]), stack)
+        self._current = []
+
+    def _lex(self, stop):
+        """
+        Lex the document until the line `stop` is lexed.
+        """
+        states = self._states
+        fragments = self._fragments
+        lookaheads = self._lookaheads
+        lookahead = getattr(self.pygments_lexer, "lookahead", None)
+        current = self._current
+        line = len(fragments)
+        for _, token, value in self._tokens:
+            if token is None:
+                states[line] = value
+                if self._last is not None and line >= self._converge:
+                    if self._reuse(line, value):
+                        if self._tokens is not None and len(self._fragments) <= stop:
+                            self._lex(stop)
+                        return
+                if line > stop:
+                    break
+                continue
+            # an error, the end of a line without a match or a token looking ahead
+            if (token is Error or token is Whitespace and value == "\n" or
+                    lookahead is not None and lookahead(token, value)) and \
+                    (not lookaheads or lookaheads[-1] != line):
+                lookaheads.append(line)
+            style = token_styles[token]
+            parts = value.split("\n")
+            for part in parts[:-1]:
+                if part:
+                    current.append((style, part))
+                fragments.append(current)
+                current = []
+                states.append(None)
+                line += 1
+            if parts[-1]:
+                current.append((style, parts[-1]))
+            if line > stop:
+                break
+        else:
+            fragments.append(current)
+            self._tokens = None
+            self._last = None
+        self._current = current
+
+    def _reuse(self, line, stack):
+        """
+        Reuse the lines of the last document from `line` if its state was `stack`.
+        """
+        states, fragments, lookaheads, finished = self._last
+        k = line + self._delta
+        if k >= len(states):
+            # the last document was not lexed so far
+            self._last = None
+            return False
+        if states[k] != stack:
+            return False
+        self._last = None
+        self._fragments.extend(fragments[k:])
+        self._states.extend(states[k + 1:])
+        self._lookaheads.extend(j - self._delta for j in lookaheads if j >= k)
+        if finished:
+            self._tokens = None
+            return True
+        # lex the rest from the last line start which is a token boundary
+        c = len(self._fragments)
+        while self._states[c] is None:
+            c -= 1
+        stack = self._states[c]
+        del self._states[c:]
+        del self._fragments[c:]
+        del self._lookaheads[bisect_left(self._lookaheads, c):]
+        self._restart(c, stack)
+        return True
+
+    def _window_line(self, document, i):
+        lines = document.lines
+        window = self._window
+        if window is None or window[0] is not lines or \
+                not window[1] <= i < window[1] + len(window[2]):
+            start, _ = self.syntax_sync.get_sync_start_position(document, i)
+            text = "\n".join(lines[start:i + LEX_AHEAD])
+            window = self._window = (
+                lines, start, split_lines(lex_with_states(self.pygments_lexer, text)))
+        return window[2][i - window[1]]
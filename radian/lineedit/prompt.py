@@ -6,7 +6,7 @@ from prompt_toolkit.application.current import get_app
 from prompt_toolkit.auto_suggest import DynamicAutoSuggest
 from prompt_toolkit.completion import DynamicCompleter, ThreadedCompleter
 from prompt_toolkit.enums import DEFAULT_BUFFER
-from prompt_toolkit.filters import Condition, emacs_mode
+from prompt_toolkit.filters import Condition, emacs_mode, has_focus
 from prompt_toolkit.key_binding.key_bindings import \
     KeyBindings, DynamicKeyBindings, merge_key_bindings
 from prompt_toolkit.validation import DynamicValidator
@@ -54,6 +54,7 @@ class ModalPromptSession(PromptSession):
     # new settings
     add_history = True
     search_no_duplicates = False
+    history_search_fuzzy = False
 
     def _check_args(self, kwargs):
         if "specs" in kwargs:
@@ -62,7 +63,7 @@ class ModalPromptSession(PromptSession):
                 assert isinstance(m, ModeSpec)
 
     def _filter_args(self, kwargs):
-        for key in ["add_history", "search_no_duplicates"]:
+        for key in ["add_history", "search_no_duplicates", "history_search_fuzzy"]:
             if key in kwargs:
                 setattr(self, key, kwargs[key])
                 del kwargs[key]
@@ -168,18 +169,14 @@ class ModalPromptSession(PromptSession):
             # enable_history_search is enabled. (First convert to Filter,
             # to avoid doing bitwise operations on bool objects.)
             complete_while_typing=Condition(
-                lambda: is_true(self.complete_while_typing)
+                lambda: (is_true(self.complete_while_typing) or self.default_buffer.fuzzy_search)
                 # and not is_true(self.enable_history_search)
                 and not self.complete_style == CompleteStyle.READLINE_LIKE
             ),
             validate_while_typing=dyncond("validate_while_typing"),
             enable_history_search=dyncond("enable_history_search"),
             validator=DynamicValidator(lambda: self.validator),
-            completer=DynamicCompleter(
-                lambda: ThreadedCompleter(self.completer)
-                if self.complete_in_thread and self.completer
-                else self.completer
-            ),
+            completer=DynamicCompleter(self._get_completer),
             history=self.history,
             auto_suggest=DynamicAutoSuggest(lambda: self.auto_suggest),
             accept_handler=accept,
@@ -189,6 +186,14 @@ class ModalPromptSession(PromptSession):
             search_no_duplicates=self.search_no_duplicates
         )
 
+    def _get_completer(self):
+        if self.default_buffer.fuzzy_search:
+            # scored in a thread, so that typing stays responsive
+            return ThreadedCompleter(self.default_buffer.fuzzy_completer)
+        if self.complete_in_thread and self.completer:
+            return ThreadedCompleter(self.completer)
+        return self.completer
+
     def _create_application(self, *args, **kwargs):
         app = super()._create_application(*args, **kwargs)
 
@@ -206,8 +211,29 @@ class ModalPromptSession(PromptSession):
 
             event.app.pre_run_callables.append(set_working_index)
 
+        fuzzy_search = Condition(lambda: self.history_search_fuzzy)
+        in_fuzzy_search = Condition(lambda: self.default_buffer.fuzzy_search)
+
+        @kb.add('c-r', filter=emacs_mode & fuzzy_search & has_focus(DEFAULT_BUFFER))
+        def _(event):
+            event.current_buffer.start_fuzzy_search()
+
+        @kb.add('c-g', filter=in_fuzzy_search)
+        @kb.add('escape', filter=in_fuzzy_search)
+        def _(event):
+            buff = event.current_buffer
+            buff.cancel_completion()
+            buff.stop_fuzzy_search()
+
         app._default_bindings = merge_key_bindings([app._default_bindings, kb])
 
+        # e.g. history compaction, deferred until the first prompt is shown
+        def start_background_tasks(app):
+            app.after_render -= start_background_tasks
+            self.history.start_background_tasks()
+
+        app.after_render += start_background_tasks
+
         return app
 
     def prompt(self, *args, **kwargs):
@@ -223,6 +249,8 @@ class ModalPromptSession(PromptSession):
                 if value is not None:
                     setattr(self._default_settings, name, value)
 
+        self.history.command_finished()
+
         orig_mode = self.current_mode
         try:
             result = super().prompt(inputhook=self._inputhook, **kwargs)
@@ -4,15 +4,15 @@ import sys
 import time
 
 from .lineedit.prompt import ModalPromptSession, ModeSpec
-from .lineedit.history import ModalInMemoryHistory, ModalFileHistory
+from .lineedit.history import ModalInMemoryHistory, ModalFileHistory, ModalMappedHistory
+from .lineedit.history_merge import MergedHistory
+from .lineedit.auto_suggest import AutoSuggestFromHistory
 from prompt_toolkit.enums import EditingMode
 from prompt_toolkit.formatted_text import ANSI
 from prompt_toolkit.layout.processors import HighlightMatchingBracketProcessor
-from prompt_toolkit.lexers import PygmentsLexer
 from prompt_toolkit.styles import style_from_pygments_cls
 from prompt_toolkit.utils import is_windows, get_term_environment_variable
 from prompt_toolkit.validation import Validator
-from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
 
 from pygments.styles import get_style_by_name
 
@@ -24,7 +24,7 @@ from . import shell
 from .key_bindings import create_r_key_bindings, create_shell_key_bindings, create_key_bindings
 from .completion import RCompleter, SmartPathCompleter
 from .io import CustomInput, CustomOutput
-from .lexer import CustomSLexer as SLexer
+from .document import RLexer
 
 
 PROMPT = "\x1b[34mr$>\x1b[0m "
@@ -108,18 +108,40 @@ def create_radian_prompt_session(options, settings):
 
     local_history_file = settings.local_history_file
     global_history_file = settings.global_history_file
-
-    if options.no_history:
-        history = ModalInMemoryHistory()
-    elif not options.global_history and os.path.exists(local_history_file):
-        history = ModalFileHistory(os.path.abspath(local_history_file), settings.history_size)
+    if settings.history_backend == "mmap":
+        file_history = ModalMappedHistory
+    elif settings.history_backend == "sqlite":
+        from .lineedit.history_sqlite import ModalSQLiteHistory
+
+        def file_history(history_file, history_size, durability, shared, dedup):
+            # the database is created next to the text history, which is imported
+            return ModalSQLiteHistory(
+                history_file + ".sqlite", history_size, history_file, shared, dedup)
     else:
+        file_history = ModalFileHistory
+
+    def global_file_history():
         history_file = os.path.join(os.path.expanduser(global_history_file))
         history_file = os.path.expandvars(history_file)
         history_file_dir = os.path.dirname(history_file)
         if not os.path.exists(history_file_dir):
             os.makedirs(history_file_dir, 0o700)
-        history = ModalFileHistory(history_file, settings.history_size)
+        return file_history(
+            history_file, settings.history_size,
+            settings.history_durability, settings.history_share, settings.history_dedup)
+
+    if options.no_history:
+        history = ModalInMemoryHistory()
+    elif not options.global_history and os.path.exists(local_history_file):
+        history = file_history(
+            os.path.abspath(local_history_file), settings.history_size,
+            settings.history_durability, settings.history_share, settings.history_dedup)
+        if settings.history_merge_global and not options.local_history:
+            global_history = global_file_history()
+            if os.path.abspath(global_history.filename) != history.filename:
+                history = MergedHistory(history, global_history)
+    else:
+        history = global_file_history()
 
     if is_windows():
         output = None
@@ -155,6 +177,7 @@ def create_radian_prompt_session(options, settings):
             return None
 
         terminal_width = [None]
+        last_history_refresh = [0]
 
         def _(context):
             output_width = session.app.output.get_size().columns
@@ -165,6 +188,10 @@ def create_radian_prompt_session(options, settings):
             while True:
                 if context.input_is_ready():
                     break
+                if settings.history_share and time.time() - last_history_refresh[0] > 1:
+                    last_history_refresh[0] = time.time()
+                    if session.default_buffer.refresh_history():
+                        session.app.invalidate()
                 try:
                     if peek_event():
                         with session.app.input.detach():
@@ -186,6 +213,7 @@ def create_radian_prompt_session(options, settings):
         history=history,
         enable_history_search=True,
         search_no_duplicates=settings.history_search_no_duplicates,
+        history_search_fuzzy=settings.history_search_fuzzy,
         search_ignore_case=settings.history_search_ignore_case,
         enable_suspend=True,
         input=CustomInput(sys.stdin),
@@ -199,6 +227,8 @@ def create_radian_prompt_session(options, settings):
         input_processors.append(HighlightMatchingBracketProcessor())
 
     r_key_bindings = create_r_key_bindings(parse_text_complete)
+    # shared by the r and the browse modes, so that a document is lexed once
+    r_lexer = RLexer(settings.highlight_max_lines)
 
     session.register_mode(
         name="r",
@@ -209,7 +239,7 @@ def create_radian_prompt_session(options, settings):
         multiline=settings.indent_lines,
         completer=RCompleter(timeout=settings.completion_timeout),
         complete_while_typing=settings.complete_while_typing,
-        lexer=PygmentsLexer(SLexer),
+        lexer=r_lexer,
         tempfile_suffix=".R",
         input_processors=input_processors,
         key_bindings=create_key_bindings(),
@@ -246,7 +276,7 @@ def create_radian_prompt_session(options, settings):
         completer=RCompleter(timeout=settings.completion_timeout),
         complete_while_typing=settings.complete_while_typing,
         validator=BrowseValidator(),
-        lexer=PygmentsLexer(SLexer),
+        lexer=r_lexer,
         tempfile_suffix=".R",
         input_processors=input_processors,
         prompt_key_bindings=r_key_bindings
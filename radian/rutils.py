@@ -1,6 +1,10 @@
+import datetime
 import os
+import signal
 import sys
-from rchitect import rcopy, reval, rcall
+import threading
+from rchitect import rcopy, reval, rcall, robject
+from rchitect.types import RObject
 from rchitect.interface import roption, setoption
 from .key_bindings import map_key
 
@@ -96,6 +100,83 @@ def register_cleanup(cleanup):
           onexit=True)
 
 
+def register_history_flush(history):
+    # R exits without finalizing python, so atexit handlers may not run
+    register_cleanup(lambda x: history.flush())
+    if history.durability == "immediate":
+        # nothing is pending
+        return
+
+    orig_handler = signal.getsignal(signal.SIGTERM)
+    if orig_handler is None:
+        # a handler installed from C can't be called after flushing
+        return
+
+    flushed = threading.Event()
+
+    def flush(signum):
+        try:
+            history.flush()
+        finally:
+            flushed.set()
+            os.kill(os.getpid(), signum)
+
+    # python handlers only run once the interpreter runs again, so SIGTERM is deferred
+    # until R returns to the prompt
+    def sigterm_handler(signum, frame):
+        if not flushed.is_set():
+            # the interrupted code may hold the locks of the history, so it is flushed by
+            # another thread, which raises the signal again once it is done
+            threading.Thread(target=flush, args=(signum,), daemon=True).start()
+            return
+        if callable(orig_handler):
+            orig_handler(signum, frame)
+        elif orig_handler != signal.SIG_IGN:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+    signal.signal(signal.SIGTERM, sigterm_handler)
+
+
+def attach_radian_tools(**functions):
+    # make the R functions or the python functions callable from R, e.g., `history_dedup()`
+    env = rcall(("base", "new.env"))
+    for name, f in functions.items():
+        if not isinstance(f, RObject):
+            f = robject(f, convert=True)
+        rcall(("base", "assign"), name, f, envir=env)
+    rcall(("base", "attach"), env, name="tools:radian", **{"warn.conflicts": False})
+
+
+# a Date would reach python as a number of days, it is converted to its start in local time
+HISTORY_ENTRIES = """
+function(history_entries) function(since = NULL, until = NULL, pattern = NULL) {
+    as_time <- function(x) if (inherits(x, "Date")) as.POSIXct(format(x)) else x
+    history_entries(as_time(since), as_time(until), pattern)
+}
+"""
+
+
+def _as_timestamp(x):
+    # a POSIXct time or a "%Y-%m-%d %H:%M:%S" string in local time
+    if x is None:
+        return None
+    if isinstance(x, str):
+        return datetime.datetime.fromisoformat(x).timestamp()
+    return float(x)
+
+
+def history_entries_tool(history):
+    def history_entries(since=None, until=None, pattern=None):
+        entries = history.find_entries(_as_timestamp(since), _as_timestamp(until), pattern)
+        return {
+            "time": [t for t, _, _ in entries],
+            "mode": [m for _, m, _ in entries],
+            "text": [s for _, _, s in entries]
+        }
+    return rcall(reval(HISTORY_ENTRIES), robject(history_entries, convert=True))
+
+
 def set_utf8():
     if sys.platform.startswith("win"):
         ucrt = rcopy(
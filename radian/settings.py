@@ -40,6 +40,7 @@ class RadianSettings(object):
         self._load_setting("color_scheme", "native")
         self._load_setting("auto_match", True, bool)
         self._load_setting("highlight_matching_bracket", False, bool)
+        self._load_setting("highlight_max_lines", 5000, int)
         self._load_setting("auto_indentation", True, bool)
         self._load_setting("tab_size", 4, int)
         self._load_setting("complete_while_typing", True, bool)
@@ -51,7 +52,13 @@ class RadianSettings(object):
         self._load_setting("local_history_file", ".radian_history")
         self._load_setting("history_search_no_duplicates", False, bool)
         self._load_setting("history_search_ignore_case", False, bool)
+        self._load_setting("history_search_fuzzy", False, bool)
         self._load_setting("history_ignore_browser_commands", True, bool)
+        self._load_setting("history_durability", "immediate")
+        self._load_setting("history_backend", "file")
+        self._load_setting("history_share", False, bool)
+        self._load_setting("history_dedup", False, bool)
+        self._load_setting("history_merge_global", False, bool)
         self._load_setting("insert_new_line", True, bool)
         self._load_setting("indent_lines", True, bool)
         self._load_prompt()
@@ -0,0 +1,44 @@
+"""
+R code for the tests of the lexers, from common code to the corner cases of strings.
+"""
+import random
+
+
+CORPUS = [
+    'x <- "abc"\ny <- \'d\'',
+    'paste0("a", `b c`, "d\\"e")\n\n  ',
+    'f <- function(x, y = "default") {\n  # a comment with \'quotes\'\n  x + y\n}\n',
+    'cat("multi\nline\nstring")\nz <- 1',
+    'x <- r"(a\nb)" + r\'-[c\n\n]-\' # "d\n"e',
+    'r"---{ )---" }--- }---" r\'----(a)-----\'',
+    'x <- r"(unterminated\ny <- 1\n"',
+    "if (x) {\n  '''\n}\n",
+    "x <- 'a\\'b' ; y <- '\\\\' ; z <- '\\'",
+    "'abc\\\ndef'",
+    "s <- \"a\\\\\\\"b\\\\\" + 1",
+    "x %in% c('a', \"b\") %>% `my fun`('c')",
+    "`a'b` <- 1; `c\"d`",
+    "x <- `unterminated 'name\ny <- 'a'",
+    "library(dplyr)\ndf %>%\n  filter(x == 'a') %>%\n  mutate(y = \"b#c\")",
+    "T.'a'\nF.\"b\"\n._'c'\n.'d'",
+    "_#('a')\n_#\n('b')",
+    "1r\"(a)\" 0x1Fr'[b]' 1e5R\"{c}\" x.r\"(d)\"",
+    "-.'a' x<-.'b'",
+    "sprintf('%s', x) # '%s'\n'#'",
+    "x <- \"\"\ny <- ''\nz <- r\"()\"",
+    "a %'% b %\"%",
+    "\"a\" \"b\n\n'c'",
+]
+
+
+def random_texts(seed, n, length=25):
+    """
+    Random texts of the characters and the pieces of R code which decide where the strings
+    are.
+    """
+    pieces = list("'\"\\\n ar(R)-[]{}#`%._T1e;x+") + [
+        'r"(', "r'-[", ")\"", "]-'", "\\\\", "\\'", "`(", "r`", "T.", ".'", "0x1", "%in%",
+        "-.", "F(", "_#", "x <- 1\n"]
+    rng = random.Random(seed)
+    for _ in range(n):
+        yield "".join(rng.choice(pieces) for _ in range(rng.randint(0, length)))
@@ -0,0 +1,53 @@
+import random
+
+from prompt_toolkit.document import Document
+
+from radian.lineedit.auto_suggest import AutoSuggestFromHistory, trie_insert, trie_lookup
+
+from .test_buffer import Session, create_buffer, accept
+
+
+def suggest(auto_suggest, buf, text):
+    suggestion = auto_suggest.get_suggestion(buf, Document(text))
+    return suggestion.text if suggestion else None
+
+
+def test_trie():
+    random.seed(1)
+    lines = ["".join(random.choice("ab(") for _ in range(random.randint(0, 6)))
+             for _ in range(300)]
+    root = ["", None, None]
+    for line in lines:
+        trie_insert(root, line, True)
+    prefixes = {line[:k] for line in lines for k in range(len(line) + 1)} | {"ba(ba", "(((("}
+    for prefix in prefixes:
+        expected = next((x for x in reversed(lines) if x.startswith(prefix)), None)
+        assert trie_lookup(root, prefix) == expected
+
+    root = ["", None, None]
+    for line in reversed(lines):
+        trie_insert(root, line, False)
+    for prefix in prefixes:
+        expected = next((x for x in reversed(lines) if x.startswith(prefix)), None)
+        assert trie_lookup(root, prefix) == expected
+
+
+def test_auto_suggest():
+    session = Session()
+    entries = [
+        ("r", "library(foo)"), ("shell", "ls -l"), ("r", "lapply(x, f)\nlibrary(bar)"),
+        ("browse", "ls()")]
+    buf = create_buffer(session, entries)
+    auto_suggest = AutoSuggestFromHistory()
+    auto_suggest.chunk_size = 1
+    assert suggest(auto_suggest, buf, "l") == "s()"
+    assert suggest(auto_suggest, buf, "lib") == "rary(bar)"
+    assert suggest(auto_suggest, buf, "lap") == "ply(x, f)"
+    assert suggest(auto_suggest, buf, "library(f") == "oo)"
+    assert suggest(auto_suggest, buf, "x <- 1\nlibrary(f") == "oo)"
+    assert suggest(auto_suggest, buf, "ls -") is None
+    assert suggest(auto_suggest, buf, " ") is None
+    accept(buf, "library(baz)")
+    assert suggest(auto_suggest, buf, "lib") == "rary(baz)"
+    session.current_mode = "shell"
+    assert suggest(auto_suggest, buf, "l") == "s -l"
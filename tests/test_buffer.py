@@ -0,0 +1,138 @@
+import pytest
+
+from prompt_toolkit.search import SearchState, SearchDirection
+
+from radian.lineedit.buffer import ModalBuffer
+from radian.lineedit.history import ModalInMemoryHistory, ModalFileHistory
+from radian.lineedit.prompt import ModeSpec
+
+
+class Session:
+    add_history = True
+
+    def __init__(self):
+        self.current_mode = "r"
+        self.specs = {
+            "r": ModeSpec("r"),
+            "browse": ModeSpec("browse", history_book="r"),
+            "shell": ModeSpec("shell")
+        }
+
+    @property
+    def current_mode_spec(self):
+        return self.specs[self.current_mode]
+
+
+@pytest.fixture
+def session():
+    return Session()
+
+
+def create_buffer(session, entries=(), **kwargs):
+    buf = ModalBuffer(
+        history=ModalInMemoryHistory(),
+        session=session,
+        search_no_duplicates=kwargs.pop("search_no_duplicates", False),
+        **kwargs)
+    for mode, text in entries:
+        accept(buf, text, mode)
+    return buf
+
+
+def accept(buf, text, mode="r"):
+    session = buf.session
+    current_mode = session.current_mode
+    session.current_mode = mode
+    buf.text = text
+    buf.append_to_history()
+    buf.reset()
+    session.current_mode = current_mode
+
+
+def test_working_lines(session):
+    buf = create_buffer(session, [("r", "a1"), ("shell", "ls"), ("browse", "a2")])
+    assert list(buf._working_lines) == ["a1", "ls", "a2", ""]
+    assert buf.working_index == 3
+    accept(buf, "a3")
+    assert list(buf._working_lines) == ["a1", "ls", "a2", "a3", ""]
+    assert buf.working_index == 4
+
+
+def test_history_navigation(session):
+    buf = create_buffer(session, [("r", "a1"), ("shell", "ls"), ("browse", "a2")])
+    buf.history_backward()
+    assert buf.text == "a2"
+    buf.history_backward()
+    assert buf.text == "a1"
+    buf.text = "b1"
+    assert list(buf.history.get_strings()) == ["a1", "ls", "a2"]
+    buf.reset()
+    assert list(buf._working_lines) == ["a1", "ls", "a2", ""]
+
+
+def test_no_consecutive_duplicates(session):
+    buf = create_buffer(session, [("r", "a1"), ("r", "a1"), ("shell", "a1"), ("r", "a2")])
+    assert list(buf.history.get_strings()) == ["a1", "a1", "a2"]
+    assert buf.history.get_modes() == ["r", "shell", "r"]
+    assert buf.history.last_entry() == ("r", "a2")
+
+
+@pytest.mark.parametrize("direction", [SearchDirection.BACKWARD, SearchDirection.FORWARD])
+@pytest.mark.parametrize("ignore_case", [False, True])
+def test_search(session, direction, ignore_case):
+    entries = [
+        ("r", "library(foo)"), ("shell", "ls foo"), ("r", "plot(x)"),
+        ("browse", "Foo <- 1"), ("r", "foo\nbar"), ("r", "x")]
+    buf = create_buffer(session, entries)
+    linear = create_buffer(session, entries)
+    linear._search_candidates = lambda text: None
+    buf._working_lines[2] = "edited foo"
+    linear._working_lines[2] = "edited foo"
+    for text in ["foo", "Foo", "oo", "ot(", "missing"]:
+        for working_index in range(len(entries) + 1):
+            state = SearchState(text, direction, ignore_case=ignore_case)
+            buf.working_index = working_index
+            linear.working_index = working_index
+            assert buf._search(state) == linear._search(state)
+
+
+def test_refresh_history(session, tmp_path):
+    path = str(tmp_path / "history")
+    buf = ModalBuffer(
+        history=ModalFileHistory(path, 100, shared=True),
+        session=session,
+        search_no_duplicates=False)
+    accept(buf, "a1")
+    other = ModalFileHistory(path, 100)
+    other.append_string("b1", "r")
+    buf.text = "x"
+    assert buf.refresh_history()
+    assert buf.text == "x"
+    assert list(buf._working_lines) == ["a1", "b1", "x"]
+    buf.history_backward()
+    assert buf.text == "b1"
+
+
+def test_history_navigation_by_book(session):
+    entries = [("r", "a1")] + [("shell", "ls{}".format(i)) for i in range(100)] + \
+        [("browse", "a2"), ("shell", "pwd")]
+    buf = create_buffer(session, entries)
+    assert list(buf.history.mode_positions("browse")) == [101]
+    buf.history_backward()
+    assert buf.text == "a2"
+    buf.history_backward(2)
+    assert buf.text == "a1"
+    buf.history_forward()
+    assert buf.text == "a2"
+    buf.history_forward()
+    assert buf.working_index == len(buf._working_lines) - 1
+    buf.history_forward()
+    assert buf.working_index == len(buf._working_lines) - 1
+
+    session.current_mode = "shell"
+    buf.reset()
+    buf.history_backward()
+    assert buf.text == "pwd"
+    accept(buf, "cd", "shell")
+    buf.history_backward()
+    assert buf.text == "cd"
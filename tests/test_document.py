@@ -0,0 +1,69 @@
+import random
+
+from prompt_toolkit.document import Document
+from pygments.token import Token
+
+from radian.document import StringContext, cursor_in_string
+from radian.lexer import CustomSLexer
+
+from .corpus import CORPUS, random_texts
+
+
+def reference(document):
+    tokens = list(CustomSLexer().get_tokens(document.text_before_cursor.rstrip()))
+    for t, s in reversed(tokens):
+        if t is Token.Text and s == "\n":
+            continue
+        return t is Token.Error or t is Token.Literal.String
+    return False
+
+
+def test_cursor_in_string():
+    for text in CORPUS:
+        for position in range(len(text) + 1):
+            document = Document(text, position)
+            assert cursor_in_string(document) == reference(document), (text, position)
+
+
+def test_cursor_in_string_random_texts():
+    for text in random_texts(0, 1000):
+        context = StringContext()
+        for position in range(len(text) + 1):
+            document = Document(text, position)
+            assert context.cursor_in_string(document) == reference(document), (text, position)
+
+
+def check(context, document):
+    context.update(document)
+    fresh = StringContext()
+    fresh.update(document)
+    assert context._starts == fresh._starts, document.text
+    assert context._lookaheads == fresh._lookaheads, document.text
+    assert context.cursor_in_string(document) == reference(document), document.text
+
+
+def test_string_context_typing():
+    context = StringContext()
+    text = "\n".join(CORPUS)
+    for i in range(len(text) + 1):
+        check(context, Document(text[:i]))
+    # typing at the top
+    for i in range(len(CORPUS[3])):
+        check(context, Document(CORPUS[3][:i] + text, i))
+
+
+def test_string_context_edits():
+    rng = random.Random(0)
+    pieces = list(random_texts(1, 200, 3))
+    for _ in range(100):
+        context = StringContext()
+        text = ""
+        for _ in range(40):
+            position = rng.randint(0, len(text))
+            if rng.random() < 0.3:
+                text = text[:position] + text[position + rng.randint(1, 5):]
+            else:
+                piece = rng.choice(pieces)
+                text = text[:position] + piece + text[position:]
+                position += len(piece)
+            check(context, Document(text, min(position, len(text))))
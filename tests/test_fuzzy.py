@@ -0,0 +1,66 @@
+import threading
+
+from prompt_toolkit.completion import CompleteEvent
+from prompt_toolkit.document import Document
+
+from radian.lineedit.buffer import ModalBuffer
+from radian.lineedit.fuzzy import fuzzy_score
+from radian.lineedit.history_sqlite import ModalSQLiteHistory
+
+from .test_buffer import Session, create_buffer
+
+
+def test_fuzzy_score():
+    assert fuzzy_score("lbr", "plot(x)") is None
+    assert fuzzy_score("lbr", "library(foo)") is not None
+    # word starts and consecutive matches are preferred
+    assert fuzzy_score("rf", "read_file(x)") > fuzzy_score("rf", "sprintf(x)")
+    assert fuzzy_score("plot", "plot(x)") > fuzzy_score("plot", "p_lo_t(x)")
+    # smart case
+    assert fuzzy_score("Foo", "foo") is None
+    assert fuzzy_score("foo", "Foo") is not None
+
+
+def complete(buf, text):
+    document = Document(text)
+    return [c.text for c in buf.fuzzy_completer.get_completions(document, CompleteEvent())]
+
+
+def test_fuzzy_completer():
+    session = Session()
+    entries = [
+        ("r", "library(foo)"), ("shell", "ls -l"), ("r", "plot(x)"),
+        ("browse", "lib <- 1"), ("r", "library(foo)"), ("r", "x")]
+    buf = create_buffer(session, entries)
+    assert complete(buf, "lib") == ["library(foo)", "lib <- 1"]
+    assert complete(buf, "l") == ["library(foo)", "lib <- 1", "plot(x)"]
+    assert complete(buf, " ") == []
+    session.current_mode = "shell"
+    assert complete(buf, "l") == ["ls -l"]
+
+
+def test_fuzzy_completer_chunks():
+    session = Session()
+    buf = create_buffer(session, [("r", "foo({})".format(i)) for i in range(10)])
+    buf.fuzzy_completer.chunk_size = 3
+    assert complete(buf, "f9") == ["foo(9)"]
+    assert complete(buf, "fo(")[:4] == ["foo(9)", "foo(8)", "foo(7)", "foo(6)"]
+    buf.fuzzy_completer.max_results = 5
+    assert len(complete(buf, "foo")) == 5
+
+
+def test_fuzzy_completer_sqlite(tmp_path):
+    path = str(tmp_path / "history.sqlite")
+    history = ModalSQLiteHistory(path, 100)
+    for text in ["library(foo)", "plot(x)"]:
+        history.append_string(text, "r")
+    # the entries of the last session are read from the database
+    history = ModalSQLiteHistory(path, 100)
+    buf = ModalBuffer(history=history, session=Session(), search_no_duplicates=False)
+    history.count()
+    # the completions are computed in a thread, as with `ThreadedCompleter`
+    results = []
+    thread = threading.Thread(target=lambda: results.append(complete(buf, "lib")))
+    thread.start()
+    thread.join()
+    assert results == [["library(foo)"]]
@@ -0,0 +1,497 @@
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from radian.lineedit.history import ModalFileHistory, ModalMappedHistory, MappedHistoryStrings
+from radian.lineedit import history_index
+from radian.lineedit.history_index import index_filename
+from radian.lineedit.history_merge import MergedHistory
+from radian.lineedit.history_sqlite import ModalSQLiteHistory
+from radian.lineedit.history_store import CompactHistoryStrings
+
+
+def has_trigram():
+    try:
+        sqlite3.connect(":memory:").execute(
+            "CREATE VIRTUAL TABLE t USING fts5(text, tokenize='trigram')")
+    except sqlite3.OperationalError:
+        return False
+    return True
+
+
+def write_history(path, n, start=0):
+    with open(path, "a") as f:
+        for i in range(start, start + n):
+            f.write("\n# time: 2024-01-01 00:00:{:02d} UTC\n# mode: {}\n+x{}\n+  y\n".format(
+                i % 60, "r" if i % 2 else "shell", i))
+
+
+def test_index_is_created(tmp_path):
+    path = str(tmp_path / "history")
+    write_history(path, 5)
+    history = ModalFileHistory(path, 100)
+    entries = list(history.load())
+    assert entries[0] == ("shell", "x4\n  y")
+    assert entries[-1] == ("shell", "x0\n  y")
+    assert os.path.exists(index_filename(path))
+
+    history = ModalFileHistory(path, 100)
+    assert list(history.load()) == entries
+
+
+def test_index_catches_up(tmp_path):
+    path = str(tmp_path / "history")
+    write_history(path, 5)
+    list(ModalFileHistory(path, 100).load())
+    # entries written without updating the index
+    write_history(path, 2, start=5)
+    history = ModalFileHistory(path, 100)
+    entries = list(history.load())
+    assert len(entries) == 7
+    assert entries[0] == ("shell", "x6\n  y")
+
+
+def test_invalid_index_is_rebuilt(tmp_path):
+    path = str(tmp_path / "history")
+    write_history(path, 5)
+    entries = list(ModalFileHistory(path, 100).load())
+    with open(index_filename(path), "wb") as f:
+        f.write(b"garbage")
+    assert list(ModalFileHistory(path, 100).load()) == entries
+
+
+def test_index_of_rewritten_file(tmp_path):
+    path = str(tmp_path / "history")
+    with open(path, "w") as f:
+        f.write("\n# mode: r\n+xxx0\n\n# mode: r\n+xxx1\n")
+    list(ModalFileHistory(path, 100).load())
+    # trimmed in place, e.g., by an older version of radian, and grown past the old size,
+    # the last indexed entry is still at the start of an entry
+    texts = ["xxx1", "100", "xxx101", "102"]
+    with open(path, "w") as f:
+        f.write("".join("\n# mode: r\n+{}\n".format(text) for text in texts))
+    history = ModalFileHistory(path, 100)
+    assert [s for _, s in history.load()] == texts[::-1]
+
+
+def test_append(tmp_path):
+    path = str(tmp_path / "history")
+    write_history(path, 5)
+    history = ModalFileHistory(path, 100)
+    list(history.load())
+    history.append_string("foo\nbar", "r")
+    assert history.get_strings()[-1] == "foo\nbar"
+
+    history = ModalFileHistory(path, 100)
+    assert next(history.load()) == ("r", "foo\nbar")
+    with open(path, "rb") as f:
+        assert f.read().endswith(b"# mode: r\n+foo\n+bar\n")
+
+
+def test_append_in_read_only_directory(tmp_path, monkeypatch):
+    path = str(tmp_path / "history")
+    write_history(path, 5)
+
+    def open_existing(name, *args, **kwargs):
+        # only the history file is writable, the lock file and the index can't be created
+        if name != path:
+            raise PermissionError(name)
+        return open(name, *args, **kwargs)
+    monkeypatch.setattr(history_index, "open", open_existing, raising=False)
+
+    history = ModalFileHistory(path, 100)
+    list(history.load())
+    history.append_string("foo", "r")
+    assert next(ModalFileHistory(path, 100).load()) == ("r", "foo")
+
+
+def test_on_exit_durability(tmp_path):
+    path = str(tmp_path / "history")
+    write_history(path, 5)
+    history = ModalFileHistory(path, 100, "on-exit")
+    list(history.load())
+    size = os.path.getsize(path)
+    history.append_string("foo", "r")
+    history.append_string("bar\nbaz", "shell")
+    assert os.path.getsize(path) == size
+    history.flush()
+
+    entries = list(ModalFileHistory(path, 100).load())
+    assert entries[:2] == [("shell", "bar\nbaz"), ("r", "foo")]
+    assert len(entries) == 7
+
+
+def test_batched_durability(tmp_path):
+    path = str(tmp_path / "history")
+    write_history(path, 5)
+    history = ModalFileHistory(path, 100, "batched")
+    history.batch_delay = 0
+    list(history.load())
+    history.append_string("foo", "r")
+    for _ in range(100):
+        if not history._pending:
+            break
+        time.sleep(0.05)
+    with history._write_lock:
+        assert next(ModalFileHistory(path, 100).load()) == ("r", "foo")
+
+
+def test_durability(tmp_path):
+    path = str(tmp_path / "history")
+    assert ModalFileHistory(path, 100, "unknown").durability == "immediate"
+    assert ModalSQLiteHistory(path + ".sqlite", 100).durability == "immediate"
+    local_history = ModalFileHistory(str(tmp_path / "local"), 100, "on-exit")
+    assert MergedHistory(local_history, ModalFileHistory(path, 100)).durability == "on-exit"
+
+
+def test_compaction(tmp_path):
+    path = str(tmp_path / "history")
+    write_history(path, 30)
+    history = ModalFileHistory(path, 20)
+    entries = list(history.load())
+    assert len(entries) == 30
+    history.compact_history()
+    # the session keeps its entries, including those removed from the file
+    assert list(history.load()) == entries
+    history.append_string("foo", "r")
+    assert history.get_strings()[-1] == "foo"
+
+    entries = list(ModalFileHistory(path, 20).load())
+    assert len(entries) == 19
+    assert entries[0] == ("r", "foo")
+    assert entries[-1] == ("shell", "x12\n  y")
+
+
+def test_compaction_by_other_session(tmp_path):
+    path = str(tmp_path / "history")
+    write_history(path, 30)
+    history = ModalFileHistory(path, 20)
+    entries = list(history.load())
+    ModalFileHistory(path, 20).compact_history()
+    assert list(history.load()) == entries
+    history.append_string("foo", "r")
+
+    entries = list(ModalFileHistory(path, 20).load())
+    assert len(entries) == 19
+    assert entries[0] == ("r", "foo")
+
+
+def test_mapped_history(tmp_path):
+    path = str(tmp_path / "history")
+    write_history(path, 5)
+    with open(path, "a") as f:
+        # an incomplete entry
+        f.write("\n# mode: r\n+z")
+    history = ModalMappedHistory(path, 100)
+    assert list(history.load()) == list(ModalFileHistory(path, 100).load())
+    assert history.count() == 5
+    assert history.get_entry(0) == ("shell", "x0\n  y")
+    # the entries are not kept in memory once they are read
+    assert not history._loaded_strings._strings
+
+
+def test_mapped_history_is_lazy(tmp_path, monkeypatch):
+    path = str(tmp_path / "history")
+    write_history(path, 30)
+    history = ModalMappedHistory(path, 100)
+    read = []
+    _read = MappedHistoryStrings._read
+    monkeypatch.setattr(
+        MappedHistoryStrings, "_read", lambda self, k: read.append(k) or _read(self, k))
+    assert history.last_entry() == ("r", "x29\n  y")
+    assert read == [29]
+
+
+@pytest.mark.parametrize("cls", [ModalFileHistory, ModalMappedHistory])
+def test_compaction_of_loaded_history(tmp_path, cls):
+    path = str(tmp_path / "history")
+    write_history(path, 30)
+    history = cls(path, 20)
+    assert history.count() == 30
+    history.get_entry(20)
+    history.compact_history()
+    entries = list(cls(path, 20).load())
+    assert len(entries) == 18
+    assert list(history.load())[:18] == entries
+    assert history.get_entry(0) == ("shell", "x0\n  y")
+
+
+@pytest.mark.parametrize("cls", [ModalFileHistory, ModalMappedHistory])
+def test_shared_history(tmp_path, cls):
+    path = str(tmp_path / "history")
+    write_history(path, 5)
+    history = cls(path, 100, shared=True)
+    other = cls(path, 100, shared=True)
+    assert history.count() == other.count() == 5
+    assert not history.refresh()
+
+    other.append_string("foo", "r")
+    history.append_string("bar", "shell")
+    other.append_string("baz", "r")
+    assert history.refresh()
+    assert history.get_strings()[5:] == ["bar", "foo", "baz"]
+    assert history.get_modes()[5:] == ["shell", "r", "r"]
+    assert other.refresh()
+    assert other.get_strings()[5:] == ["foo", "baz", "bar"]
+    assert not history.refresh()
+    assert not other.refresh()
+
+
+def test_shared_history_after_compaction(tmp_path):
+    path = str(tmp_path / "history")
+    write_history(path, 30)
+    history = ModalFileHistory(path, 20, shared=True)
+    other = ModalFileHistory(path, 20, shared=True)
+    assert history.count() == other.count() == 30
+
+    history.append_string("foo", "r")
+    other.compact_history()
+    other.append_string("bar", "r")
+    assert history.refresh()
+    assert history.get_strings()[30:] == ["foo", "bar"]
+    assert other.refresh()
+    assert other.get_strings()[30:] == ["bar", "foo"]
+
+
+def test_sqlite_history(tmp_path):
+    path = str(tmp_path / "history")
+    write_history(path, 5)
+    history = ModalSQLiteHistory(path + ".sqlite", 100, path)
+    assert list(history.load()) == list(ModalFileHistory(path, 100).load())
+    history.append_string("Foo\nbar", "r")
+    history.command_finished()
+    assert history.last_entry() == ("r", "Foo\nbar")
+
+    history = ModalSQLiteHistory(path + ".sqlite", 100, path)
+    assert history.count() == 6
+    if has_trigram():
+        assert history._fts
+    assert history.get_entry(5) == ("r", "Foo\nbar")
+    assert history.search_candidates("foo") == [5]
+    assert history.search_candidates("x3\n") == [3]
+    assert history.search_candidates("fo") is None
+
+
+def test_sqlite_shared_history(tmp_path):
+    path = str(tmp_path / "history.sqlite")
+    history = ModalSQLiteHistory(path, 100, shared=True)
+    other = ModalSQLiteHistory(path, 100, shared=True)
+    assert history.count() == other.count() == 0
+    other.append_string("foo", "r")
+    history.append_string("bar", "shell")
+    assert history.refresh()
+    assert list(history.get_strings()) == ["bar", "foo"]
+    assert history.search_candidates("foo") == [1]
+    assert not history.refresh()
+
+
+def test_sqlite_compaction(tmp_path):
+    path = str(tmp_path / "history")
+    write_history(path, 30)
+    history = ModalSQLiteHistory(path + ".sqlite", 20, path)
+    entries = list(history.load())
+    history.compact_history()
+    assert list(history.load()) == entries
+    assert list(ModalSQLiteHistory(path + ".sqlite", 20).load()) == entries[:18]
+    # the deleted entries are still searched
+    assert 5 in history.search_candidates("x5\n")
+    assert 29 in history.search_candidates("x29\n")
+
+
+def test_compact_store():
+    entries = [("r", "foo"), ("shell", "ls\n"), (None, "é\U0001f600"), ("r", "")]
+    store = CompactHistoryStrings(entries)
+    assert list(store) == entries
+    assert store[-2] == (None, "é\U0001f600")
+    assert store[1:3] == entries[1:3]
+    for i in range(300):
+        store.append((str(i), "x"))
+    assert store[-1] == ("299", "x")
+    assert store[0] == ("r", "foo")
+
+
+@pytest.mark.parametrize("cls", [ModalFileHistory, ModalMappedHistory])
+def test_dedup(tmp_path, cls):
+    path = str(tmp_path / "history")
+    history = cls(path, 100)
+    for mode, text in [("r", "a"), ("shell", "a"), ("r", "b\nc"), ("r", "a"), ("r", "b\nc"),
+                       ("r", "d")]:
+        history.append_string(text, mode)
+    entries = list(history.load())
+    assert history.dedup_history() == 2
+    assert list(history.load()) == entries
+    assert list(cls(path, 100).load()) == [("r", "d"), ("r", "b\nc"), ("r", "a"), ("shell", "a")]
+    history.append_string("e", "r")
+    assert next(cls(path, 100).load()) == ("r", "e")
+    assert history.dedup_history() == 0
+    with open(path) as f:
+        assert f.read().count("# time: ") == 5
+
+
+@pytest.mark.parametrize("cls", [ModalFileHistory, ModalMappedHistory])
+def test_dedup_keeps_positions(tmp_path, cls):
+    path = str(tmp_path / "history")
+    write_history(path, 10)
+    write_history(path, 10, start=5)
+    history = cls(path, 100)
+    entries = list(history.load())
+    strings = history._loaded_strings
+    times = list(strings.timestamps())
+    assert history.dedup_history() == 5
+    assert list(history.load()) == entries
+    assert list(strings.timestamps()) == times
+    # only the removed entries are kept in memory
+    assert sorted(strings._times) == [5, 6, 7, 8, 9]
+    # compaction after deduplication
+    history.max_history_size = 10
+    history.compact_history()
+    assert list(history.load()) == entries
+    assert list(strings.timestamps()) == times
+
+
+@pytest.mark.parametrize("cls", [ModalFileHistory, ModalMappedHistory])
+def test_dedup_after_compaction(tmp_path, cls):
+    path = str(tmp_path / "history")
+    write_history(path, 30)
+    write_history(path, 10, start=25)
+    history = cls(path, 20)
+    entries = list(history.load())
+    strings = history._loaded_strings
+    times = list(strings.timestamps())
+    history.compact_history()
+    assert history.dedup_history() == 5
+    assert list(history.load()) == entries
+    assert list(strings.timestamps()) == times
+    assert [e[1] for e in cls(path, 100).load()] == \
+        ["x{}\n  y".format(i) for i in range(34, 21, -1)]
+
+
+def test_mapped_history_has_no_index(tmp_path):
+    path = str(tmp_path / "history")
+    write_history(path, 30)
+    write_history(path, 5)
+    history = ModalMappedHistory(path, 20, dedup=True)
+    entries = list(history.load())
+    history.compact_history()
+    assert list(history.load()) == entries
+    assert len(list(ModalMappedHistory(path, 20).load())) == 18
+    assert not os.path.exists(index_filename(path))
+
+
+def test_dedup_on_compaction(tmp_path):
+    path = str(tmp_path / "history")
+    write_history(path, 10)
+    write_history(path, 10)
+    history = ModalFileHistory(path, 100, dedup=True)
+    assert history.count() == 20
+    history.start_background_tasks()
+    for _ in range(100):
+        if len(list(ModalFileHistory(path, 100).load())) == 10:
+            break
+        time.sleep(0.05)
+    assert list(ModalFileHistory(path, 100).load()) == list(history.load())[:10]
+
+
+def test_sqlite_dedup(tmp_path):
+    path = str(tmp_path / "history.sqlite")
+    history = ModalSQLiteHistory(path, 100)
+    for mode, text in [("r", "a"), ("shell", "a"), ("r", "b"), ("r", "a")]:
+        history.append_string(text, mode)
+    entries = list(history.load())
+    assert history.dedup_history() == 1
+    assert list(history.load()) == entries
+    assert list(ModalSQLiteHistory(path, 100).load()) == [("r", "a"), ("r", "b"), ("shell", "a")]
+
+
+def test_sqlite_dedup_while_storing(tmp_path):
+    path = str(tmp_path / "history.sqlite")
+    history = ModalSQLiteHistory(path, 100, dedup=True)
+    for text in ["a", "b", "a"]:
+        history.append_string(text, "r")
+    history.load()
+    # the completion thread reads the history while an entry is deduplicated
+    with history._lock:
+        compaction = threading.Thread(target=history.compact_history)
+        compaction.start()
+        time.sleep(0.1)
+        history.append_string("c", "r")
+    compaction.join()
+    assert list(history.load()) == [("r", "c"), ("r", "a"), ("r", "b"), ("r", "a")]
+    assert list(ModalSQLiteHistory(path, 100).load()) == [("r", "c"), ("r", "a"), ("r", "b")]
+
+
+@pytest.mark.parametrize("cls", [ModalFileHistory, ModalMappedHistory])
+def test_time_range(tmp_path, cls):
+    path = str(tmp_path / "history")
+    write_history(path, 10)
+    # written by a session with a slower clock
+    write_history(path, 1, 3)
+    history = cls(path, 100)
+    t0 = 1704067200.0
+    assert history.get_timestamp(10) == t0 + 3
+    assert history.time_range(t0 + 2, t0 + 5) == range(2, 5)
+    assert history.time_range(t0 + 20) == range(11, 11)
+    # the late entry is placed after the newest entry before it
+    assert [e[2] for e in history.find_entries(t0 + 3, t0 + 4)] == ["x3\n  y"]
+    assert [e[2] for e in history.find_entries(t0 + 3, t0 + 10)][-2:] == ["x9\n  y", "x3\n  y"]
+    assert [e[2] for e in history.find_entries(t0, t0 + 8, "X5")] == ["x5\n  y"]
+
+    now = time.time()
+    history.append_string("z", "r")
+    assert history.find_entries(now - 1) == [(history.get_timestamp(11), "r", "z")]
+
+
+def test_sqlite_time_range(tmp_path):
+    path = str(tmp_path / "history")
+    write_history(path, 10)
+    history = ModalSQLiteHistory(path + ".sqlite", 100, path)
+    t0 = 1704067200.0
+    assert history.time_range(t0 + 2, t0 + 5) == range(2, 5)
+    assert [e[2] for e in history.find_entries(t0, t0 + 8, "x5")] == ["x5\n  y"]
+    history.append_string("z", "r")
+    assert [e[2] for e in history.find_entries(t0 + 60)] == ["z"]
+
+
+def test_merged_history(tmp_path):
+    local_path = str(tmp_path / "local")
+    global_path = str(tmp_path / "global")
+    with open(local_path, "w") as f:
+        for i in (1, 4, 5):
+            f.write("\n# time: 2024-01-01 00:00:{:02d} UTC\n# mode: r\n+local{}\n".format(i, i))
+    with open(global_path, "w") as f:
+        for i in (0, 2, 3, 6):
+            f.write("\n# time: 2024-01-01 00:00:{:02d} UTC\n# mode: r\n+global{}\n".format(i, i))
+    history = MergedHistory(ModalFileHistory(local_path, 100), ModalFileHistory(global_path, 100))
+    assert history.count() == 7
+    assert history.get_entry(6) == ("r", "global6")
+    assert history.get_entry(5) == ("r", "local5")
+    # only the newest entries are merged
+    assert len(history._loaded_strings._merged_sources) == 2
+    assert history.mode_positions("r") is None
+    assert len(history._loaded_strings._merged_sources) == 2
+    assert [s for _, s in history.load()] == [
+        "global6", "local5", "local4", "global3", "global2", "local1", "global0"]
+
+    history.append_string("new", "r")
+    assert history.get_entry(7) == ("r", "new")
+    assert next(ModalFileHistory(local_path, 100).load()) == ("r", "new")
+    assert next(ModalFileHistory(global_path, 100).load()) == ("r", "global6")
+
+
+def test_merged_shared_history(tmp_path):
+    local_path = str(tmp_path / "local")
+    global_path = str(tmp_path / "global")
+    write_history(local_path, 2)
+    write_history(global_path, 2)
+    history = MergedHistory(
+        ModalFileHistory(local_path, 100, shared=True),
+        ModalFileHistory(global_path, 100, shared=True))
+    assert history.count() == 4
+    history.append_string("a", "r")
+    assert not history.refresh()
+    ModalFileHistory(global_path, 100).append_string("b", "r")
+    assert history.refresh()
+    assert [s for _, s in history.load()][:2] == ["b", "a"]
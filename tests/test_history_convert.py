@@ -0,0 +1,46 @@
+import json
+
+from radian.lineedit.history import ModalFileHistory
+from radian.lineedit.history_convert import convert, read_rhistory, guess_format
+
+
+def test_rhistory_import(tmp_path):
+    source = str(tmp_path / ".Rhistory")
+    with open(source, "w") as f:
+        f.write("x <- 1\n##------ Mon Jan  1 00:00:00 2024 ------##\nplot(x)\n\nsummary(x)\n")
+    target = str(tmp_path / "history")
+    assert guess_format(source) == "rhistory"
+    assert convert(source, target) == 3
+    entries = list(ModalFileHistory(target, 100).load())
+    assert entries == [("r", "summary(x)"), ("r", "plot(x)"), ("r", "x <- 1")]
+    timestamps = [t for _, t, _ in read_rhistory(source)]
+    assert timestamps[0] == 0 and timestamps[1] == timestamps[2] > 0
+
+
+def test_round_trip(tmp_path):
+    source = str(tmp_path / "history")
+    history = ModalFileHistory(source, 100)
+    history.append_entries([
+        ("r", 1704067200.0, "f <- function() {\n  1\n}"),
+        ("shell", 1704067201.0, "ls"),
+        ("r", 0.0, "f()")])
+    with open(source) as f:
+        assert f.read().count("# time: 2024-01-01 00:00:0") == 2
+
+    jsonl = str(tmp_path / "history.jsonl")
+    assert convert(source, jsonl) == 3
+    with open(jsonl) as f:
+        assert json.loads(next(f)) == {
+            "time": 1704067200.0, "mode": "r", "text": "f <- function() {\n  1\n}"}
+
+    db = str(tmp_path / "history.sqlite")
+    assert convert(jsonl, db) == 3
+    target = str(tmp_path / "history2")
+    assert convert(db, target) == 3
+    with open(source) as f, open(target) as g:
+        assert f.read() == g.read()
+
+    rhistory = str(tmp_path / ".Rhistory")
+    assert convert(target, rhistory) == 2
+    with open(rhistory) as f:
+        assert f.read() == "f <- function() {\n  1\n}\nf()\n"
@@ -0,0 +1,198 @@
+import random
+
+import pytest
+
+from prompt_toolkit.document import Document
+from prompt_toolkit.lexers import PygmentsLexer
+from pygments.token import Comment, String, Text
+
+from radian.document import R_SYNC, RLexer, scan
+from radian.lexer import CustomSLexer, unterminated
+from radian.lineedit.lexer import IncrementalLexer, LEX_AHEAD, lex_with_states, token_styles
+
+from .corpus import random_texts
+
+
+SOURCE = """\
+f <- function(x, y = 1) {
+  # a comment with 'quotes'
+  s <- "a string
+spanning lines"
+  r <- r"(raw ' " string)"
+  z <- x + y * 2L
+  if (z > 0) z else NULL
+}
+`my var` <- c(1, 2, 3) %>% sum()
+"""
+
+
+def reference(text):
+    get_line = PygmentsLexer(CustomSLexer).lex_document(Document(text))
+    return [
+        [f for f in get_line(i) if f[1]]
+        for i in range(len(Document(text).lines))]
+
+
+def lex(lexer, text):
+    get_line = lexer.lex_document(Document(text))
+    return [get_line(i) for i in range(len(Document(text).lines))]
+
+
+def edits():
+    # typing the source character by character
+    for i in range(len(SOURCE) + 1):
+        yield SOURCE[:i]
+    # opening and closing a string at the top
+    yield 'x <- "' + SOURCE
+    yield SOURCE
+    # deleting and inserting lines
+    lines = SOURCE.split("\n")
+    for i in range(len(lines)):
+        yield "\n".join(lines[:i] + lines[i + 1:])
+        yield "\n".join(lines[:i] + ["r'[", "]'"] + lines[i:])
+
+
+def test_incremental_lexer():
+    lexer = IncrementalLexer(CustomSLexer)
+    for text in edits():
+        assert lex(lexer, text) == reference(text), text
+
+
+def test_incremental_lexer_closing_string():
+    # the strings are not closed until the last line is typed
+    lexer = IncrementalLexer(CustomSLexer)
+    for text in ["x <- 'a\ny <- 1\n", "x <- 'a\ny <- 1\n'", "x <- r\"(\ny\n", "x <- r\"(\ny\n)\""]:
+        assert lex(lexer, text) == reference(text), text
+
+
+def test_incremental_lexer_lookahead():
+    # the tokens of the first line change with the last line
+    lexer = IncrementalLexer(CustomSLexer)
+    opened = "r`T.\\\\\ne}]x\\\\[#'.%in'\\\\)#xx<()\"-'"
+    for text in [opened, opened + "\n`", "x %\ny\n", "x %\ny\n%", "f\n\n\n", "f\n\n\n("]:
+        assert lex(lexer, text) == reference(text), text
+
+
+def test_incremental_lexer_random_edits():
+    rng = random.Random(0)
+    pieces = list(random_texts(1, 200, 8))
+    for _ in range(300):
+        lexer = IncrementalLexer(CustomSLexer)
+        text = ""
+        for _ in range(40):
+            position = rng.randint(0, len(text))
+            if rng.random() < 0.3:
+                text = text[:position] + text[position + rng.randint(1, 5):]
+            else:
+                text = text[:position] + rng.choice(pieces) + text[position:]
+            assert lex(lexer, text) == reference(text), text
+
+
+@pytest.mark.parametrize("text", ["", "\n", "'", "x\n\n\ny", "r'(\n\n"])
+def test_incremental_lexer_edge_cases(text):
+    lexer = IncrementalLexer(CustomSLexer)
+    assert lex(lexer, text) == reference(text)
+    assert lex(lexer, "x" + text) == reference("x" + text)
+
+
+def test_incremental_lexer_displayed_lines():
+    # only some lines of each document are displayed
+    rng = random.Random(0)
+    lexer = IncrementalLexer(CustomSLexer)
+    for text in edits():
+        n = len(Document(text).lines)
+        expected = reference(text)
+        get_line = lexer.lex_document(Document(text))
+        start = rng.randint(0, n - 1)
+        for i in range(start, min(start + 3, n)):
+            assert get_line(i) == expected[i], text
+
+
+def test_incremental_lexer_lexes_displayed_lines():
+    text = SOURCE * 100
+    lexer = IncrementalLexer(CustomSLexer)
+    get_line = lexer.lex_document(Document(text))
+    assert get_line(5) == reference(SOURCE)[5]
+    assert len(lexer._fragments) <= 5 + LEX_AHEAD + 1
+
+
+def test_incremental_lexer_syntax_sync():
+    text = SOURCE * 100
+    expected = reference(text)
+    n = len(expected)
+    lexer = IncrementalLexer(CustomSLexer, syntax_sync=R_SYNC, max_lines_backwards=50)
+    get_line = lexer.lex_document(Document(text))
+    assert [get_line(i) for i in range(n - 20, n)] == expected[n - 20:]
+    assert len(lexer._fragments) == 0
+    # typing at the end
+    text = text + "x <- 'a"
+    get_line = lexer.lex_document(Document(text))
+    assert [get_line(i) for i in range(n - 20, n)] == reference(text)[n - 20:]
+
+
+def test_r_lexer_max_lines():
+    lexer = RLexer(max_lines=5)
+    styles = set(
+        style for line in lex(lexer, SOURCE) for style, _ in line
+        if style != token_styles[Text])
+    assert styles == {token_styles[String], token_styles[Comment.Single]}
+    assert lex(lexer, "x <- 1") == reference("x <- 1")
+
+
+class ReferenceSLexer(CustomSLexer):
+    """
+    The lexer with a state for every kind of raw string, as the raw strings were lexed
+    before `match_raw_string`.
+    """
+    tokens = {}
+    statements = []
+    quotes = (("'", "squote"), ('"', "dquote"))
+    dash_runs = (("", ""), ("-", "1"), ("--", "2"), ("---", "3"), ("-{4,}", "4"))
+    brackets = (("(", ")", "r"), ("[", "]", "s"), ("{", "}", "c"))
+    for quote, quote_name in quotes:
+        for dashes, suffix in dash_runs:
+            for opening, closing, bracket_name in brackets:
+                state = "string_{}_{}{}".format(quote_name, bracket_name, suffix)
+                statements.append(
+                    (r"(r|R)\{}{}\{}".format(quote, dashes, opening), String, state))
+                tokens[state] = [
+                    (r"(.|\n)*?\{}{}\{}".format(closing, dashes, quote), String, "#pop")]
+    tokens["statements"] = []
+    for rule in CustomSLexer.tokens["statements"]:
+        if isinstance(rule, tuple) and (callable(rule[0]) or rule[0].startswith("[rR]")):
+            continue
+        tokens["statements"].append(rule)
+        if rule == (r"\"", String, "string_dquote"):
+            tokens["statements"].extend(statements)
+    del quotes, dash_runs, brackets, rule, statements, quote, quote_name, dashes, suffix
+    del opening, closing, bracket_name, state
+
+
+RAW_STRINGS = [
+    "r'(a)'", 'R"[a\nb]"', "r'{}'", "r'-(a)-'", "r'--[)']--'", 'r"---{ }--- }---"',
+    "r'----(a)-----'", "r'-----(a)----' x", "r\"(a)'\" + 1", "r'(a)-' b\nc)'",
+    "r'(", "r'(a\nb", "x <- r'[ unterminated\ny <- 1", "r\"----{ )---\" }----- \"",
+    "f(r'(a)', r\"[b]\")", "'(a)'", "r'-(a)'-'", "r'[]'"
+]
+
+
+@pytest.mark.parametrize("text", RAW_STRINGS)
+def test_raw_strings(text):
+    tokens = list(CustomSLexer().get_tokens_unprocessed(text))
+    assert tokens == list(ReferenceSLexer().get_tokens_unprocessed(text))
+    assert tokens == [
+        (pos, token, value) for pos, token, value in
+        lex_with_states(CustomSLexer(), text) if token is not None]
+
+
+def test_unterminated_raw_strings_are_not_kept():
+    text = "x <- r'(" * 10 + "\ny <- r\"[\n"
+    tokens = CustomSLexer().get_tokens_unprocessed(text)
+    next(tokens)
+    # the closers which are not found are only remembered while the text is lexed
+    assert unterminated.get(text) is not None
+    list(tokens)
+    list(lex_with_states(CustomSLexer(), text))
+    list(scan(text))
+    assert unterminated.get(text) is None
+    assert not unterminated._texts